@@ -0,0 +1,167 @@
+"""
+Benchmark for subtitle comparison in modules/diff_utils.py.
+
+Compares every pair of subtitles within each recording-sized group, the way
+duplicate checks do, once with the old are_functionally_identical (which
+normalised both inputs with uncompiled regexes on every call) and once with
+the memoised content_fingerprint. Every pair must give the same answer.
+
+Uses the .ass/.srt/.vtt files under --corpus when given, otherwise builds a
+synthetic corpus with BOMs, CRLF line endings, Aegisub project garbage and
+mixed time marker precision.
+
+Run from the repository root:
+    python3 -m benchmarks.fingerprint [--corpus DIR] [--group 8] [--repeat 3]
+"""
+import argparse
+import os
+import random
+import re
+import time
+
+from modules import diff_utils
+
+SUBTITLE_EXTENSIONS = ('.ass', '.srt', '.vtt', '.sub', '.sbv')
+
+def legacy_are_functionally_identical(content1, content2):
+    """The comparison as it was before fingerprinting."""
+    if isinstance(content1, bytes):
+        try:
+            content1 = content1.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            content1 = content1.decode('utf-8', errors='ignore')
+    if isinstance(content2, bytes):
+        try:
+            content2 = content2.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            content2 = content2.decode('utf-8', errors='ignore')
+
+    def clean_content(content):
+        lines = [line.strip() for line in content.splitlines()]
+        cleaned_lines = []
+        skip_section = False
+        for line in lines:
+            if line == '[Aegisub Project Garbage]':
+                skip_section = True
+                continue
+            if skip_section and line.startswith('['):
+                skip_section = False
+            if skip_section:
+                continue
+            if not line:
+                continue
+            line = re.sub(r'(\d+:\d+:\d+)\.(\d{2})\d*', r'\1.\2', line)
+            line = re.sub(r'(\d+:\d+)\.(\d{2})\d*', r'\1.\2', line)
+            line = ' '.join(line.split())
+            line = line.replace(', ', ',').replace(' ,', ',')
+            cleaned_lines.append(line)
+        return cleaned_lines
+
+    return clean_content(content1) == clean_content(content2)
+
+def srt_timestamp(seconds, precision):
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    fraction = f"{seconds % 1:.{precision}f}"[2:]
+    return f"{int(hours):02}:{int(minutes):02}:{int(secs):02},{fraction}"
+
+def ass_timestamp(seconds, precision):
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    fraction = f"{seconds % 1:.{precision}f}"[2:]
+    return f"{int(hours)}:{int(minutes):02}:{int(secs):02}.{fraction}"
+
+def synthetic_srt(rng, cues, precision, crlf, bom):
+    lines = []
+    for cue in range(1, cues + 1):
+        start = cue * 2.5 + rng.random()
+        lines += [str(cue), f"{srt_timestamp(start, precision)} --> {srt_timestamp(start + 2, precision)}",
+                  f"Line {cue}, sung by  the company", ""]
+    text = ("\r\n" if crlf else "\n").join(lines)
+    return ("\ufeff" if bom else "").encode('utf-8') + text.encode('utf-8')
+
+def synthetic_ass(rng, cues, precision, garbage):
+    lines = ["[Script Info]", "Title: Synthetic", "ScriptType: v4.00+", ""]
+    if garbage:
+        lines += ["[Aegisub Project Garbage]", "Audio File: show.mkv", f"Video Position: {rng.randint(0, 9999)}", ""]
+    lines += ["[Events]", "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text"]
+    for cue in range(1, cues + 1):
+        start = cue * 2.5
+        lines.append(f"Dialogue: 0,{ass_timestamp(start, precision)},{ass_timestamp(start + 2, precision)},Default,,0,0,0,,Line {cue}")
+    return "\n".join(lines).encode('utf-8')
+
+def build_corpus(recordings, per_recording, cues, seed=1):
+    """Groups of subtitles per recording, with functional duplicates among them."""
+    rng = random.Random(seed)
+    groups = []
+    for _ in range(recordings):
+        base_cues = cues + rng.randint(-cues // 4, cues // 4)
+        group = []
+        for index in range(per_recording):
+            variant = rng.randint(0, 3)
+            if index % 2:
+                group.append(synthetic_ass(random.Random(len(groups)), base_cues, 2 + variant % 2, garbage=variant > 1))
+            else:
+                group.append(synthetic_srt(random.Random(len(groups)), base_cues, 3, crlf=variant > 1, bom=variant == 3))
+        groups.append(group)
+    return groups
+
+def load_corpus(directory, group_size):
+    files = []
+    for root, _, names in os.walk(directory):
+        for name in sorted(names):
+            if name.lower().endswith(SUBTITLE_EXTENSIONS):
+                with open(os.path.join(root, name), 'rb') as f:
+                    files.append(f.read())
+    return [files[i:i + group_size] for i in range(0, len(files), group_size)]
+
+def compare_pairs(groups, compare):
+    results = []
+    for group in groups:
+        for i, first in enumerate(group):
+            for second in group[i + 1:]:
+                results.append(compare(first, second))
+    return results
+
+def measure(label, groups, compare, repeat, reset=None):
+    elapsed = []
+    for _ in range(repeat):
+        if reset:
+            reset()
+        start = time.perf_counter()
+        results = compare_pairs(groups, compare)
+        elapsed.append(time.perf_counter() - start)
+    print(f"{label:<22} | {min(elapsed) * 1000:>10.1f}ms")
+    return results
+
+def clear_fingerprint_cache():
+    diff_utils._fingerprint_cache.clear()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark subtitle comparison")
+    parser.add_argument('--corpus', help="Directory of real subtitle files")
+    parser.add_argument('--group', type=int, default=8, help="Subtitles per recording")
+    parser.add_argument('--recordings', type=int, default=40, help="Synthetic recordings to build")
+    parser.add_argument('--cues', type=int, default=400, help="Cues per synthetic subtitle")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.corpus:
+        groups = load_corpus(args.corpus, args.group)
+    else:
+        groups = build_corpus(args.recordings, args.group, args.cues)
+    files = sum(len(group) for group in groups)
+    total_bytes = sum(len(content) for group in groups for content in group)
+    print(f"Corpus: {files} subtitles ({total_bytes / 2**20:.1f}MB) in {len(groups)} groups\n")
+
+    print(f"{'Comparison':<22} | {'Time':>12}")
+    print(f"{'-'*22}-+-{'-'*12}")
+    legacy = measure('legacy', groups, legacy_are_functionally_identical, args.repeat)
+    cold = measure('fingerprint (cold)', groups, diff_utils.are_functionally_identical, args.repeat, clear_fingerprint_cache)
+    warm = measure('fingerprint (warm)', groups, diff_utils.are_functionally_identical, args.repeat)
+
+    print(f"\nPairs compared: {len(legacy)}, identical: {sum(legacy)}")
+    print(f"Results match: {legacy == cold == warm}")
+
+if __name__ == "__main__":
+    main()
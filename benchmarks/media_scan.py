@@ -0,0 +1,146 @@
+"""
+Micro-benchmark for the media evaluator in modules/manage_file_sizes.py.
+
+Builds a synthetic DVD-style recording (VIDEO_TS with many VOB/IFO/BUP files
+plus a few extras) and compares the old two-walk evaluation, which walked the
+folder once for the aggregated formats and again for the VOB summary with an
+os.path.getsize call per file, against the fused single scandir pass.
+
+Run from the repository root:
+    python3 -m benchmarks.media_scan [--discs 4] [--titles 60] [--repeat 20]
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from modules import manage_file_sizes
+
+class SyscallCounter:
+    """Counts directory scans and stat calls made through os during a run."""
+
+    def __init__(self):
+        self.scans = 0
+        self.stats = 0
+
+    def __enter__(self):
+        self._scandir = os.scandir
+        self._getsize = os.path.getsize
+        counter = self
+
+        class CountingEntry:
+            def __init__(self, entry):
+                self._entry = entry
+
+            def __getattr__(self, name):
+                return getattr(self._entry, name)
+
+            def stat(self, *args, **kwargs):
+                counter.stats += 1
+                return self._entry.stat(*args, **kwargs)
+
+        class CountingScandir:
+            def __init__(self, iterator):
+                self._iterator = iterator
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc_info):
+                self._iterator.close()
+
+            def __iter__(self):
+                return self
+
+            def __next__(self):
+                return CountingEntry(next(self._iterator))
+
+            def close(self):
+                self._iterator.close()
+
+        def scandir(path='.'):
+            counter.scans += 1
+            return CountingScandir(self._scandir(path))
+
+        def getsize(path):
+            counter.stats += 1
+            return self._getsize(path)
+
+        os.scandir = scandir
+        os.path.getsize = getsize
+        return self
+
+    def __exit__(self, *exc_info):
+        os.scandir = self._scandir
+        os.path.getsize = self._getsize
+
+def legacy_summary(directory):
+    """The pre-fusion evaluator: two os.walk passes with a getsize per file."""
+    media_stats = {'video': {}, 'audio': {}, 'vob': {'total_size': 0, 'has_ifo': False, 'has_bup': False}}
+    for root, _, files in os.walk(directory):
+        for file in files:
+            file_ext = os.path.splitext(file)[1].lower()
+            file_size_bytes = os.path.getsize(os.path.join(root, file))
+            for category, formats in (('video', manage_file_sizes.VIDEO_FORMATS), ('audio', manage_file_sizes.AUDIO_FORMATS)):
+                if file_ext in formats:
+                    info = media_stats[category].setdefault(file_ext, {'file_size': 0, 'count': 0})
+                    info['file_size'] += file_size_bytes
+                    info['count'] += 1
+    for root, _, files in os.walk(directory):
+        for file in files:
+            file_ext = os.path.splitext(file)[1].lower()
+            file_size_bytes = os.path.getsize(os.path.join(root, file))
+            if file_ext == '.vob':
+                media_stats['vob']['total_size'] += file_size_bytes
+            elif file_ext == '.ifo':
+                media_stats['vob']['has_ifo'] = True
+            elif file_ext == '.bup':
+                media_stats['vob']['has_bup'] = True
+    return manage_file_sizes.generate_media_summary(media_stats)
+
+def build_recording(root, discs, titles):
+    for disc in range(1, discs + 1):
+        video_ts = os.path.join(root, f"Disc {disc}", 'VIDEO_TS')
+        os.makedirs(video_ts)
+        for title in range(1, titles + 1):
+            for ext, size in (('VOB', 4096), ('IFO', 64), ('BUP', 64)):
+                with open(os.path.join(video_ts, f"VTS_{title:02}_1.{ext}"), 'wb') as f:
+                    f.write(b'\0' * size)
+    extras = os.path.join(root, 'Extras')
+    os.makedirs(extras)
+    for name in ('Bows.mp4', 'Interview.mkv', 'Cast.txt'):
+        with open(os.path.join(extras, name), 'wb') as f:
+            f.write(b'\0' * 1024)
+
+def measure(label, func, directory, repeat):
+    with SyscallCounter() as counter:
+        summary = func(directory)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(directory)
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{label:<10} | {counter.scans:>13} | {counter.stats:>10} | {elapsed * 1000:>9.2f}ms")
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the media evaluator")
+    parser.add_argument('--discs', type=int, default=4)
+    parser.add_argument('--titles', type=int, default=60)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='media-scan-')
+    try:
+        build_recording(root, args.discs, args.titles)
+        print(f"{'Evaluator':<10} | {'Dir scans':>13} | {'Stat calls':>10} | {'Time/run':>11}")
+        print(f"{'-'*10}-+-{'-'*13}-+-{'-'*10}-+-{'-'*11}")
+        legacy = measure('two-walk', legacy_summary, root, args.repeat)
+        fused = measure('fused', manage_file_sizes.process_directory, root, args.repeat)
+        print(f"\nSummaries match: {legacy == fused}")
+        print(f"Summary: {fused}")
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == "__main__":
+    main()
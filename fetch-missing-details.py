@@ -1,24 +1,11 @@
 import os
-import requests
 import csv
-from dotenv import load_dotenv
-from modules.api_utils import authenticated_request
-
-# Load environment variables from .env
-load_dotenv()
-
-# Get the API key from .env
-api_key = os.getenv('ENCORA_API_KEY')
-base_url = "https://encora.it/api/recording"
+from modules.api_utils import get_client
 
 def fetch_recording_details(encora_id):
     """Fetch recording details from the Encora API."""
-    headers = {
-        'Authorization': f'Bearer {api_key}',
-        'User-Agent': 'BootOrganiser'
-    }
     try:
-        response = authenticated_request('GET', f"{base_url}/{encora_id}", headers=headers)
+        response = get_client().get(f"recording/{encora_id}")
         return response.json()
     except Exception as e:
         print(f"Error fetching details for Encora ID {encora_id}: {e}")
@@ -1,64 +1,163 @@
 import os
 import sys
 import argparse
+import asyncio
 import tqdm
 from modules.config import config
 from modules.cleanup_processing import clean_processing_folder
-from modules.collection_checker import compare_local_encora_ids
-from modules.download_subtitles import download_subtitles_for_folders
+from modules.collection_checker import load_previous_locations, reconcile_collection, write_collection_report
+from modules.download_subtitles import download_subtitles_for_folders_async
 from modules.non_encora_processing import move_folders_with_ne
-from modules.encora_id_processing import fetch_collection, find_local_encora_ids, process_encora_ids
+from modules.encora_id_processing import fetch_collection, find_local_encora_ids, match_local_folders, process_encora_ids_async
 from modules.cast_file_generator import create_cast_files, create_encora_id_files
-from modules.move_and_rename_folders import move_folders_to_processing, move_and_rename_folders
-from modules.manage_file_sizes import process_directory, send_format
-from modules.diff_utils import clear_diff_files, log_missing_smalls
+from modules.move_and_rename_folders import (
+    move_folders_to_processing, move_and_rename_folders, plan_moves, save_move_plan,
+    load_move_plan, report_move_conflicts, apply_move_plan, recover_interrupted_moves
+)
+from modules.manage_file_sizes import get_media_summary, needs_format_update
+from modules.format_queue import FormatQueue, flush_format_queue
+from modules.move_journal import load_open_moves
+from modules.diff_utils import clear_diff_files, flush_reports, log_missing_smalls
+from modules.inventory import LibraryInventory
+from modules.collection_index import CollectionIndex
+from modules.collection_snapshot import update_snapshot_formats
+from modules.scan_cache import ScanCache
+from modules.async_api import AsyncEncoraClient
 
 
 sys.stdout.reconfigure(line_buffering=True)
 
+def report_format_updates(updated_formats):
+    """Records sent format updates in the collection snapshot, and prints how many there were."""
+    update_snapshot_formats(dict(updated_formats))
+
+    if updated_formats:
+        print(f"Updated formats for {len(updated_formats)} recordings.")
+    else:
+        print("No format updates were needed.")
+
+def run_formats_only():
+    """Sends the format updates left in the journal without running the organiser."""
+    if not config.api_key:
+        print("Error: ENCORA_API_KEY not set.")
+        return
+    report_format_updates(flush_format_queue())
+
+def run_move_plan(plan_path):
+    """
+    Works out where every matched recording would be moved to and writes the
+    plan to plan_path as JSON, without changing anything on disk or on Encora.
+    """
+    main_directory = config.main_directory
+    if main_directory is None:
+        print("Error: BOOTLEG_MAIN_DIRECTORY not found in config.")
+        return
+
+    open_moves = load_open_moves()
+    if open_moves:
+        print(f"Warning: {len(open_moves)} folder moves from an interrupted run are recovered when a plan is applied; this plan may be out of date.")
+    print('Scanning library...')
+    scan_cache = ScanCache(config.scan_cache_path) if config.scan_cache_enabled else None
+    inventory = LibraryInventory(main_directory).build(scan_cache)
+    local_ids = find_local_encora_ids(main_directory, inventory)
+
+    print('This may take some time to fetch your collection from Encora...')
+    collection = CollectionIndex(fetch_collection())
+    match_local_folders(collection, local_ids)
+    uncollected = len({str(encora_id) for encora_id, _ in local_ids if encora_id not in collection})
+    if uncollected:
+        print(f"{uncollected} local IDs are not in your collection yet and are left out of the plan.")
+
+    plan = plan_moves(collection, main_directory, inventory)
+    save_move_plan(plan, plan_path)
+    conflicts = report_move_conflicts(plan)
+    print(f"Planned {len(plan['moves']) - len(conflicts)} moves ({len(conflicts)} conflicts) in {plan_path}.")
+
+    if scan_cache is not None:
+        inventory.save(scan_cache)
+        scan_cache.close()
+
+def run_apply_plan(plan_path):
+    """Applies a move plan written by --plan."""
+    try:
+        plan = load_move_plan(plan_path)
+    except (OSError, ValueError) as e:
+        print(f"Error: Could not read move plan '{plan_path}': {e}")
+        return
+    report_move_conflicts(plan)
+    moved = apply_move_plan(plan)
+    print(f"Moved {moved} folders.")
+
 def run_organiser():
+    asyncio.run(run_organiser_async())
+
+async def run_organiser_async():
+    """
+    Runs every stage on one event loop: API work goes through a shared
+    AsyncEncoraClient so bulk stages run concurrently under the rate limit.
+    """
     main_directory = config.main_directory
     if main_directory is None:
         print("Error: BOOTLEG_MAIN_DIRECTORY not found in config.")
         return
 
+    api = AsyncEncoraClient()
+    # The collection download doesn't depend on the disk, so it runs while the library is scanned.
+    # Its messages are held back until it finishes so they don't interleave with the scan's.
+    print('This may take some time to fetch your collection from Encora...')
+    collection_messages = []
+    collection_task = asyncio.create_task(asyncio.to_thread(fetch_collection, collection_messages.append, False))
+    await asyncio.sleep(0)  # Let the task hand fetch_collection to its worker thread
+
     # Clear previous diff files
     clear_diff_files()
 
+    # Finish or undo any folder moves an interrupted run left half done, before the library is scanned
+    recover_interrupted_moves()
+
     # Step 1: Find Encora IDs and process them
     # (Previously we moved everything to !processing, but now we work in-place)
     # Step 1: Find Encora IDs and process them
 
+    # Scan the library once; every stage below reads and updates this inventory
+    print('Scanning library...')
+    scan_cache = ScanCache(config.scan_cache_path) if config.scan_cache_enabled else None
+    inventory = LibraryInventory(main_directory).build(scan_cache)
+
     # Step 2: Handle '!non-encora' folder processing
     non_encora_folder = os.path.join(main_directory, '!non-encora')
-    move_folders_with_ne(main_directory, non_encora_folder)
+    move_folders_with_ne(main_directory, non_encora_folder, inventory)
 
     print('Starting script...')
-    print('This may take some time to fetch your collection from Encora...')
-    local_ids = find_local_encora_ids(main_directory)
-    encora_data = fetch_collection()
-    recording_data = process_encora_ids(encora_data, local_ids)
+    local_ids = find_local_encora_ids(main_directory, inventory)
+    collection = CollectionIndex(await collection_task)
+    for message in collection_messages:
+        print(message.lstrip('\n'))
+    recording_data = await process_encora_ids_async(api, collection, local_ids)
 
     # Step 4: Generate cast files & .encora_id files if enabled
     if config.generate_cast_files:
         print(f"Generating cast files for {len(recording_data)} recordings")
-        create_cast_files(recording_data)
+        create_cast_files(collection, inventory)
 
     if config.generate_encoraid_files:
         print(f"Generating .encora-id files for {len(recording_data)} recordings")
-        create_encora_id_files(recording_data)
+        create_encora_id_files(collection, inventory)
+    flush_reports()
 
-    # Step 5: Evaluate file sizes and update Encora format
-    updated_formats_count = 0
-    desc = "Updating non-matching Encora Formats..." if config.update_encora_format else "Evaluating file sizes..."
-    for encora_id, folder_path in tqdm.tqdm(local_ids, desc=desc, unit="ID"):
+    # Step 5: Evaluate file sizes; non-matching formats are sent by the queue's workers meanwhile
+    format_queue = FormatQueue().start() if config.update_encora_format else None
+    for encora_id, folder_path in tqdm.tqdm(local_ids, desc="Evaluating file sizes...", unit="ID"):
         if config.exclude_format_update and str(encora_id) in config.excluded_ids:
+            if format_queue is not None:
+                format_queue.discard(encora_id)
             continue
 
-        summary = process_directory(folder_path)  
+        # Unchanged recordings reuse their cached summary without touching the disk
+        summary = get_media_summary(encora_id, folder_path, inventory, scan_cache)
         if(summary):
             if "VOB (no smalls)" in summary:
-                matching_recording = next((item for item in recording_data if str(item['encora_id']) == str(encora_id)), None)
+                matching_recording = collection.local_entry(encora_id)
                 if matching_recording:
                     rec_data = matching_recording.get('recording_data', {})
                     show = rec_data.get('show', 'Unknown Show')
@@ -68,28 +167,46 @@ def run_organiser():
                     log_missing_smalls(encora_id, show, tour, date, master)
 
             # Update encora formats _if_ enabled and the current format doesn't match what is local
-            if config.update_encora_format:
-                if send_format(recording_data, encora_id, summary):
-                    updated_formats_count += 1
-    
-    if updated_formats_count > 0:
-        print(f"Updated formats for {updated_formats_count} recordings.")
-    else:
-        print("No format updates were needed.")
+            if format_queue is not None and needs_format_update(collection, encora_id, summary):
+                format_queue.put(encora_id, summary)
+                continue
+
+        # This run's evaluation supersedes anything resumed from the last run's journal
+        if format_queue is not None:
+            format_queue.discard(encora_id)
+
+    if format_queue is not None:
+        if len(format_queue):
+            print(f"Waiting for {len(format_queue)} format updates to finish sending...")
+        report_format_updates(await asyncio.to_thread(format_queue.close))
+    flush_reports()
 
     # Step 6: Move and rename folders based on encora_data
-    move_and_rename_folders(recording_data, main_directory)
+    move_and_rename_folders(collection, main_directory, inventory)
 
     # Step 5: Clean up empty directories
     from modules.cleanup_processing import delete_empty_directories
-    delete_empty_directories(main_directory)
+    delete_empty_directories(main_directory, inventory)
 
     # Step 8: Download subtitles
     if config.redownload_subtitles:
-        download_subtitles_for_folders(main_directory, recording_data)
-
-    # Step 9: Check for any missing
-    missing_ids, extra_ids = compare_local_encora_ids(local_ids, encora_data)
+        await download_subtitles_for_folders_async(api, main_directory, collection, inventory)
+        flush_reports()
+
+    if scan_cache is not None:
+        inventory.save(scan_cache)
+        scan_cache.close()
+
+    # Step 9: Check for any missing, extra, duplicated or relocated IDs
+    # (re-read from the inventory so the report reflects where folders ended up)
+    current_ids = find_local_encora_ids(main_directory, inventory)
+    report = reconcile_collection(current_ids, collection, load_previous_locations())
+    write_collection_report(report)
+    missing_ids = report['missing_locally']
+    if report['duplicated_locally']:
+        print(f"Found {len(report['duplicated_locally'])} Encora IDs in more than one folder (see collection_report.json).")
+    if report['relocated']:
+        print(f"{len(report['relocated'])} recordings have moved since the last run.")
 
     # Write missing IDs to a file if count > 0
     if missing_ids and len(missing_ids) > 0:
@@ -101,9 +218,18 @@ def run_organiser():
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Bootleg Organiser")
     parser.add_argument("--auto", action="store_true", help="Run without GUI")
+    parser.add_argument("--formats-only", action="store_true", help="Send queued Encora format updates and exit")
+    parser.add_argument("--plan", nargs="?", const="move_plan.json", metavar="FILE", help="Write the folder moves a run would make to FILE and exit")
+    parser.add_argument("--apply", metavar="FILE", help="Apply a move plan written by --plan and exit")
     args = parser.parse_args()
 
-    if args.auto:
+    if args.formats_only:
+        run_formats_only()
+    elif args.plan:
+        run_move_plan(args.plan)
+    elif args.apply:
+        run_apply_plan(args.apply)
+    elif args.auto:
         run_organiser()
     else:
         try:
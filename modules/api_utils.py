@@ -1,74 +1,234 @@
+import random
+import threading
 import time
 import requests
+from urllib.parse import urljoin, urlparse
+from requests.adapters import HTTPAdapter
+from modules.config import config
 
-def handle_rate_limit(response):
+# Seconds the API's rate limit window lasts when it doesn't send X-RateLimit-Reset
+RATE_LIMIT_WINDOW = 60
+# Longest single wait, so a bad header can't stall the organiser for hours
+MAX_WAIT = 3600
+# Stages that can each have API_WORKERS requests in flight on the shared client at
+# once: the format queue's workers, AsyncEncoraClient and the collection page fetch
+CONCURRENT_API_STAGES = 3
+
+def backoff_delay(attempt, base=1, cap=60):
+    """Exponential backoff with full jitter: a random wait of up to base * 2**attempt seconds."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def parse_wait_time(headers):
     """
-    Checks if a response indicates a rate limit has been reached and waits if necessary.
-    Returns True if a wait occurred, False otherwise.
+    Returns how long the server asked us to wait, from Retry-After (seconds)
+    or X-RateLimit-Reset (epoch time), or None if it didn't say.
     """
-    # Check status code or X-RateLimit-Remaining header
-    is_rate_limited = (response.status_code == 429 or 
-                       response.headers.get('X-RateLimit-Remaining') == '0')
-    
-    if is_rate_limited:
-        # 1. Try Retry-After (usually in seconds)
-        wait_time = response.headers.get('Retry-After')
-        if wait_time:
+    wait_time = headers.get('Retry-After')
+    if wait_time:
+        try:
+            return min(max(int(wait_time), 1), MAX_WAIT)
+        except ValueError:
+            pass
+
+    reset_time = headers.get('X-RateLimit-Reset')
+    if reset_time:
+        try:
+            return min(max(int(reset_time) - int(time.time()), 1), MAX_WAIT)
+        except ValueError:
+            pass
+    return None
+
+class RateLimiter:
+    """
+    Token bucket shared by every Encora API call in the process.
+
+    The bucket size and remaining tokens are taken from the X-RateLimit-Limit
+    and X-RateLimit-Remaining headers of each response, and tokens refill
+    evenly over the rate limit window. Requests wait for a token before they
+    are sent, so the organiser slows down before the server starts returning
+    429s instead of after. Until the first response arrives nothing is paced.
+    """
+
+    def __init__(self, window=RATE_LIMIT_WINDOW):
+        self._lock = threading.Lock()
+        self.window = window
+        self.limit = None
+        self.tokens = None
+        self.updated = time.monotonic()
+        self.paused_until = 0
+
+    def _refill(self, now):
+        if self.limit is not None:
+            self.tokens = min(self.limit, self.tokens + (now - self.updated) * self.limit / self.window)
+        self.updated = now
+
+    def acquire(self):
+        """Blocks until a request may be sent, then takes a token for it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.limit is None or self.tokens >= 1:
+                    if self.limit is not None:
+                        self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) * self.window / self.limit
+            time.sleep(wait)
+
+    def update(self, headers):
+        """Syncs the bucket with the rate limit headers of a response."""
+        limit = headers.get('X-RateLimit-Limit')
+        remaining = headers.get('X-RateLimit-Remaining')
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
             try:
-                wait_time = int(wait_time)
+                if limit is not None:
+                    self.limit = max(1, int(limit))
+                    if self.tokens is None:
+                        self.tokens = self.limit
+                if remaining is not None and self.limit is not None:
+                    # The server's count is authoritative, but other threads may
+                    # already have spent tokens it hasn't seen yet
+                    self.tokens = min(self.tokens, max(0, int(remaining)))
             except ValueError:
-                wait_time = 60 # Fallback
-        else:
-            # 2. Try X-RateLimit-Reset (epoch time)
-            reset_time = response.headers.get('X-RateLimit-Reset')
-            if reset_time:
-                try:
-                    wait_time = max(0, int(reset_time) - int(time.time()))
-                except ValueError:
-                    wait_time = 60 # Fallback
-            else:
-                # 3. Default fallback
-                wait_time = 60
-        
-        # Ensure we don't wait forever, but respect the limit
-        wait_time = min(max(wait_time, 1), 3600) 
-        
-        print(f"\n[Rate Limit] Limit reached. Waiting for {wait_time} seconds before retrying...")
-        time.sleep(wait_time + 1) # Plus a small buffer
+                return
+
+            if remaining == '0':
+                wait_time = parse_wait_time(headers)
+                if wait_time is not None:
+                    self.paused_until = max(self.paused_until, now + wait_time)
+
+    def pause(self, seconds):
+        """Holds back every request in the process for the given number of seconds."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+rate_limiter = RateLimiter()
+
+def handle_rate_limit(response, attempt=0):
+    """
+    Updates the shared rate limiter from a response and, if the server
+    returned 429 Too Many Requests, pauses all API calls until it can be
+    retried. Returns True if the request was rate limited, False otherwise.
+    """
+    rate_limiter.update(response.headers)
+    if response.status_code != 429:
+        return False
+
+    wait_time = parse_wait_time(response.headers)
+    if wait_time is None:
+        wait_time = backoff_delay(attempt, base=2)
+    else:
+        # Spread out the threads that were all told to come back at the same moment
+        wait_time += random.uniform(0, 1)
+
+    print(f"\n[Rate Limit] Limit reached. Waiting for {wait_time:.0f} seconds before retrying...")
+    rate_limiter.pause(wait_time)
+    return True
+
+def is_retryable(error):
+    """Connection problems, timeouts and server errors are worth retrying; other client errors aren't."""
+    response = getattr(error, 'response', None)
+    if response is None:
         return True
-    
-    return False
+    return response.status_code >= 500 or response.status_code in (408, 429)
 
 def authenticated_request(method, url, session=None, **kwargs):
     """
-    Performs an authenticated request with automatic rate limit handling and retries.
+    Performs an authenticated request paced by the shared rate limiter, with
+    a bounded number of retries using exponential backoff and jitter.
     """
     if session is None:
-        session = requests.Session()
-    
-    # Use the session if provided, otherwise requests.request
+        return get_client().request(method, url, **kwargs)
+
     req_func = getattr(session, method.lower())
-    
+
     retries = kwargs.pop('retries', 3)
-    
-    while retries >= 0:
+    attempt = 0
+
+    while True:
+        rate_limiter.acquire()
         try:
             response = req_func(url, **kwargs)
-            
-            if handle_rate_limit(response):
-                # Rate limit was handled, retry the same request if we have retries left
-                if retries > 0:
-                    continue 
-            
-            # If we still get a 429 after waiting, or any other error, raise_for_status might catch it
+            if handle_rate_limit(response, attempt) and retries > 0:
+                retries -= 1
+                attempt += 1
+                continue
+
+            # Still rate limited after the last retry, or any other error status
             response.raise_for_status()
             return response
-            
+
         except requests.exceptions.RequestException as e:
-            if retries == 0:
+            if retries == 0 or not is_retryable(e):
                 raise e
-            print(f"\n[API Error] {e}. Retrying ({retries} left)...")
-            time.sleep(2)
+            delay = backoff_delay(attempt)
+            print(f"\n[API Error] {e}. Retrying in {delay:.1f}s ({retries} left)...")
+            time.sleep(delay)
             retries -= 1
-    
-    return None
+            attempt += 1
+
+class EncoraClient:
+    """
+    One keep-alive session for every Encora API call, so connections are
+    reused instead of paying a TCP and TLS handshake per request.
+
+    The connection pool holds API_WORKERS connections for each stage that can
+    run alongside the others, so concurrent stages never open throwaway
+    connections. The session sends the auth, User-Agent and
+    gzip headers itself. Requests to other hosts, such as subtitle files,
+    reuse the pool but never get the API key.
+    """
+    BASE_URL = "https://encora.it/api/"
+
+    def __init__(self, api_key=None, pool_size=None):
+        self.api_key = config.api_key if api_key is None else api_key
+        pool_size = max(1, pool_size or config.api_workers * CONCURRENT_API_STAGES)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Authorization': f'Bearer {self.api_key}',
+            'User-Agent': 'BootOrganiser',
+            'Accept-Encoding': 'gzip, deflate'
+        })
+
+    def url(self, path):
+        """Resolves an API path such as 'recording/123' against the API base URL."""
+        return urljoin(self.BASE_URL, path.lstrip('/'))
+
+    def request(self, method, path, **kwargs):
+        url = self.url(path)
+        if urlparse(url).hostname != urlparse(self.BASE_URL).hostname:
+            headers = dict(kwargs.pop('headers', None) or {})
+            headers.setdefault('Authorization', None)  # None drops the session header
+            kwargs['headers'] = headers
+        return authenticated_request(method, url, session=self.session, **kwargs)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Returns the shared EncoraClient, replacing it if the API key has changed."""
+    global _client
+    with _client_lock:
+        if _client is None or _client.api_key != config.api_key:
+            if _client is not None:
+                _client.close()
+            _client = EncoraClient()
+        return _client
@@ -0,0 +1,44 @@
+import asyncio
+from tqdm import tqdm
+from modules.config import config
+from modules.api_utils import get_client
+
+class AsyncEncoraClient:
+    """
+    asyncio front end to the shared EncoraClient for bulk API work.
+
+    Each request runs the blocking client call on a worker thread, so it
+    keeps the pooled session, the process-wide rate limiter and the bounded
+    retries of authenticated_request. At most API_WORKERS requests are in
+    flight at once, and a bulk stage finishes as fast as the rate limit
+    allows rather than one round trip at a time.
+    """
+
+    def __init__(self, client=None, concurrency=None):
+        self.client = client or get_client()
+        self.semaphore = asyncio.Semaphore(max(1, concurrency or config.api_workers))
+
+    @property
+    def api_key(self):
+        return self.client.api_key
+
+    async def run(self, func, *args, **kwargs):
+        """Runs a blocking call that uses the client, such as a streamed download, as one request slot."""
+        async with self.semaphore:
+            return await asyncio.to_thread(func, *args, **kwargs)
+
+    async def request(self, method, path, **kwargs):
+        return await self.run(self.client.request, method, path, **kwargs)
+
+    async def get(self, path, **kwargs):
+        return await self.request('GET', path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request('POST', path, **kwargs)
+
+async def gather_with_progress(coroutines, desc, unit="it"):
+    """Runs coroutines concurrently with a tqdm bar and returns their results in order."""
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc=desc, unit=unit):
+        await task
+    return [task.result() for task in tasks]
@@ -99,7 +99,7 @@ def generate_template(recording_data):
 
     return template
 
-def write_cast_file(path, content, encora_id):
+def write_cast_file(path, content, encora_id, inventory=None):
     cast_file_path = os.path.join(path, 'Cast.txt')
     # Check if the file exists and read its content
     if os.path.exists(cast_file_path):
@@ -113,15 +113,17 @@ def write_cast_file(path, content, encora_id):
         
     with open(cast_file_path, 'w', encoding='utf-8') as file:
         file.write(content)
+    if inventory is not None:
+        inventory.add_file(cast_file_path)
     return True
 
-def create_cast_files(encora_data):
+def create_cast_files(collection, inventory=None):
     from modules.config import config
     excluded_ids = config.excluded_ids
     skip_cast = config.exclude_cast_files
     updated_count = 0
     
-    for entry in encora_data:
+    for entry in collection.local:
         path = entry['path']
         encora_id = str(entry['encora_id'])
         
@@ -132,7 +134,7 @@ def create_cast_files(encora_data):
         # Generate template
         template = generate_template(recording_data)
         # Write to Cast.txt
-        if write_cast_file(path, template, encora_id):
+        if write_cast_file(path, template, encora_id, inventory):
             updated_count += 1
             
     if updated_count > 0:
@@ -140,8 +142,8 @@ def create_cast_files(encora_data):
     else:
         print("All local Cast.txt files are already up to date.")
 
-def create_encora_id_files(encora_data):
-    for entry in encora_data:
+def create_encora_id_files(collection, inventory=None):
+    for entry in collection.local:
         path = entry['path']
         recording_data = entry['recording_data']
         
@@ -159,7 +161,14 @@ def create_encora_id_files(encora_data):
         encora_id_file_path = os.path.join(path, f'.encora-{encora_id}')
         
         # Check if the file already exists
-        if not os.path.exists(encora_id_file_path):
+        if inventory is not None and path in inventory:
+            exists = inventory.has_file(encora_id_file_path)
+        else:
+            exists = os.path.exists(encora_id_file_path)
+
+        if not exists:
             # Create an empty .encora-ID file
             with open(encora_id_file_path, 'w', encoding='utf-8'):
-                pass
\ No newline at end of file
+                pass
+            if inventory is not None:
+                inventory.add_file(encora_id_file_path)
\ No newline at end of file
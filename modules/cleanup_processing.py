@@ -1,21 +1,40 @@
 import os
 import shutil
+from modules.inventory import LibraryInventory
+from modules.parallel_walk import scan_tree
 
 def get_folder_size(folder):
-    """Returns the total size of the folder in bytes."""
-    total_size = 0
-    for dirpath, dirnames, filenames in os.walk(folder):
-        for f in filenames:
-            fp = os.path.join(dirpath, f)
-            if not os.path.islink(fp):  # Skip symbolic links
-                total_size += os.path.getsize(fp)
-    return total_size
+    """Returns the total size of the folder in bytes, scanning subfolders in parallel."""
+    def scan_directory(path, _):
+        total_size, children = 0, []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            children.append((entry.path, entry.stat(follow_symlinks=False)))
+                        elif entry.is_file(follow_symlinks=False):  # Skip symbolic links
+                            total_size += entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+        return total_size, children
 
-def delete_empty_directories(directory):
+    return sum(size for _, size in scan_tree(folder, scan_directory))
+
+def delete_empty_directories(directory, inventory=None):
     """Recursively delete all empty directories within the given directory."""
-    for dirpath, dirnames, filenames in os.walk(directory, topdown=False):
+    if inventory is None:
+        inventory = LibraryInventory(directory).build()
+
+    for dirpath, dirnames, filenames in inventory.walk(directory, topdown=False):
         if not dirnames and not filenames:
-            os.rmdir(dirpath)
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                continue  # Not empty after all, or already gone
+            inventory.remove_folder(dirpath)
 
 def clean_processing_folder(main_directory):
     """Delete empty directories inside !processing and the folder itself if empty."""
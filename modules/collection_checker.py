@@ -1,28 +1,78 @@
+import json
+import os
+from datetime import datetime
 from modules.config import config
 
-def compare_local_encora_ids(local_ids, encora_data):
-    """Compare local Encora IDs with the fetched Encora collection"""
-    
-    encora_collection_ids = [str(item['recording']['id']).strip() for item in encora_data if 'recording' in item and 'id' in item['recording']]
-    
-    # Normalize local IDs: Extract only the Encora ID from tuples or strings
-    normalized_local_ids = []
+REPORT_FILE = 'collection_report.json'
+
+def normalise_local_ids(local_ids):
+    """Returns (encora_id, path) pairs from find_local_encora_ids tuples or bare ID strings."""
+    normalised = []
     for item in local_ids:
         if isinstance(item, tuple):
             # If it's a tuple, assume the first element is the Encora ID
-            normalized_local_ids.append(str(item[0]).strip())
+            normalised.append((str(item[0]).strip(), item[1] if len(item) > 1 else None))
         elif isinstance(item, str):
             # If it's a string, extract the Encora ID (e.g., from "{e-2004467}")
             # This part is mostly a fallback as find_local_encora_ids returns tuples
-            match = item.strip().strip('{}').replace('e-', '')
-            normalized_local_ids.append(match)
-        else:
-            continue
-    
-    # Find missing Encora IDs locally
-    missing_ids = [encora_id for encora_id in encora_collection_ids if encora_id not in normalized_local_ids]
-    
-    # Find extra Encora IDs locally
-    extra_ids = [encora_id for encora_id in normalized_local_ids if encora_id not in encora_collection_ids]
-    
-    return missing_ids, extra_ids
\ No newline at end of file
+            normalised.append((item.strip().strip('{}').replace('e-', ''), None))
+    return normalised
+
+def load_previous_locations(report_file=REPORT_FILE):
+    """Returns the {encora_id: [paths]} map recorded by the last run, if any."""
+    try:
+        with open(report_file, 'r', encoding='utf-8') as f:
+            return json.load(f).get('locations', {})
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+def reconcile_collection(local_ids, collection, previous_locations=None):
+    """
+    Reconciles local folders against the Encora collection in linear time.
+    Returns a report of IDs missing locally, extra locally, duplicated locally
+    (the same ID in several folders) and relocated since the previous run.
+    """
+    collection_ids = [str(encora_id).strip() for encora_id in collection.ids()]
+    collection_id_set = set(collection_ids)
+
+    locations = {}
+    for encora_id, path in normalise_local_ids(local_ids):
+        paths = locations.setdefault(encora_id, [])
+        if path is not None:
+            paths.append(path)
+
+    missing_ids = [encora_id for encora_id in collection_ids if encora_id not in locations]
+    extra_ids = [encora_id for encora_id in locations if encora_id not in collection_id_set]
+    duplicated = {encora_id: paths for encora_id, paths in locations.items() if len(paths) > 1}
+
+    relocated = {}
+    for encora_id, previous_paths in (previous_locations or {}).items():
+        current_paths = locations.get(encora_id)
+        if current_paths and set(current_paths) != set(previous_paths):
+            relocated[encora_id] = {'from': previous_paths, 'to': current_paths}
+
+    return {
+        'missing_locally': missing_ids,
+        'extra_locally': extra_ids,
+        'duplicated_locally': duplicated,
+        'relocated': relocated,
+        'locations': locations
+    }
+
+def write_collection_report(report, report_file=REPORT_FILE):
+    """Writes a reconciliation report as JSON."""
+    output = {
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'main_directory': config.main_directory,
+        'counts': {key: len(report[key]) for key in ('missing_locally', 'extra_locally', 'duplicated_locally', 'relocated')},
+        **report
+    }
+    tmp_file = f"{report_file}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(output, f, indent=2)
+    os.replace(tmp_file, report_file)
+
+def compare_local_encora_ids(local_ids, collection):
+    """Compare local Encora IDs with the fetched Encora collection"""
+    report = reconcile_collection(local_ids, collection)
+    return report['missing_locally'], report['extra_locally']
@@ -0,0 +1,85 @@
+import os
+from collections import defaultdict
+
+class CollectionIndex:
+    """
+    The Encora collection indexed by recording ID, together with the local
+    folders matched to it.
+
+    Collection items are the raw {'recording': ..., 'format': ...} entries from
+    fetch_collection(). Local entries are the {'encora_id', 'path',
+    'recording_data', 'my_format'} dicts the organiser stages work on, indexed
+    by recording ID and by path.
+    """
+
+    def __init__(self, encora_data=None):
+        self._items = {}  # Recording ID -> collection item
+        self.local = []  # Local entries, in the order they were matched
+        self._local_by_id = defaultdict(list)  # Recording ID -> [local entry]
+        self._local_by_path = {}  # Normalised path -> local entry
+
+        for item in encora_data or []:
+            self.add(item)
+
+    @staticmethod
+    def _path_key(path):
+        return os.path.normcase(os.path.normpath(path))
+
+    def add(self, item):
+        """Adds or replaces a collection item."""
+        recording = item.get('recording') or {}
+        if 'id' not in recording:
+            return
+        self._items[str(recording['id'])] = item
+
+    def get(self, encora_id):
+        """Returns the collection item for a recording ID, or None."""
+        return self._items.get(str(encora_id))
+
+    def recording(self, encora_id):
+        item = self.get(encora_id)
+        return item.get('recording', {}) if item else None
+
+    def ids(self):
+        return self._items.keys()
+
+    def __contains__(self, encora_id):
+        return str(encora_id) in self._items
+
+    def __iter__(self):
+        return iter(self._items.values())
+
+    def __len__(self):
+        return len(self._items)
+
+    def add_local(self, encora_id, path, recording_data, my_format=""):
+        """Records a local folder matched to a recording and returns its entry."""
+        entry = {
+            'encora_id': encora_id,
+            'path': path,
+            'recording_data': recording_data,
+            'my_format': my_format
+        }
+        self.local.append(entry)
+        self._local_by_id[str(encora_id)].append(entry)
+        self._local_by_path[self._path_key(path)] = entry
+        return entry
+
+    def local_entry(self, encora_id):
+        """Returns the first local entry for a recording ID, or None."""
+        entries = self._local_by_id.get(str(encora_id))
+        return entries[0] if entries else None
+
+    def local_entries(self, encora_id):
+        return list(self._local_by_id.get(str(encora_id), []))
+
+    def local_at(self, path):
+        """Returns the local entry for a folder path, or None."""
+        return self._local_by_path.get(self._path_key(path))
+
+    def move_local(self, old_path, new_path):
+        """Records that a local recording folder has moved."""
+        entry = self._local_by_path.pop(self._path_key(old_path), None)
+        if entry is not None:
+            entry['path'] = new_path
+            self._local_by_path[self._path_key(new_path)] = entry
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import time
+from modules.config import config
+
+def item_id(item):
+    """Returns the recording ID of a collection item as a string."""
+    return str((item.get('recording') or {}).get('id'))
+
+def page_checksum(items):
+    """Returns a stable hash of one page of collection items."""
+    return hashlib.sha256(json.dumps(items, sort_keys=True).encode('utf-8')).hexdigest()
+
+def read_snapshot_file():
+    try:
+        with open(config.collection_snapshot_path, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(snapshot, dict) or not isinstance(snapshot.get('items'), list) or not isinstance(snapshot.get('pages'), dict):
+        return None
+    return snapshot
+
+def load_collection_snapshot():
+    """
+    Returns the saved collection snapshot, or None if there isn't a usable one.
+    A snapshot older than COLLECTION_FULL_SYNC_HOURS, or saved with a
+    different page size, is ignored so the next fetch is a full one.
+    """
+    if not config.collection_snapshot_enabled:
+        return None
+    snapshot = read_snapshot_file()
+    if snapshot is None:
+        return None
+    if snapshot.get('page_size') != config.collection_page_size:
+        return None
+    if time.time() - snapshot.get('full_sync_at', 0) > config.collection_full_sync_hours * 3600:
+        return None
+    return snapshot
+
+def write_snapshot_file(snapshot):
+    path = config.collection_snapshot_path
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Warning: Could not save collection snapshot: {e}")
+
+def save_collection_snapshot(pages, page_headers, total, full_sync_at=None):
+    """
+    Writes the collection to the snapshot file for the next run's incremental
+    sync. pages maps each page number to its items, and page_headers to the
+    response headers it was served with, so every page can be revalidated on
+    its own next time.
+    """
+    if not config.collection_snapshot_enabled:
+        return
+    items, page_meta = [], {}
+    for number in sorted(pages):
+        headers = page_headers.get(number) or {}
+        items.extend(pages[number])
+        page_meta[str(number)] = {
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'ids': [item_id(item) for item in pages[number]],
+            'checksum': page_checksum(pages[number])
+        }
+    write_snapshot_file({
+        'saved_at': time.time(),
+        'full_sync_at': full_sync_at or time.time(),
+        'page_size': config.collection_page_size,
+        'total': total if total is not None else len(items),
+        'page_count': len(pages),
+        'pages': page_meta,
+        'items': items
+    })
+
+def snapshot_page(snapshot, page):
+    """Returns the items the snapshot holds for a page, or None if it can't say."""
+    meta = snapshot['pages'].get(str(page))
+    if meta is None:
+        return None
+    known = {item_id(item): item for item in snapshot['items']}
+    if any(recording_id not in known for recording_id in meta['ids']):
+        return None
+    return [known[recording_id] for recording_id in meta['ids']]
+
+def conditional_headers(snapshot, page=1):
+    """Returns If-None-Match / If-Modified-Since headers for one page of the snapshot."""
+    headers = {}
+    meta = snapshot['pages'].get(str(page)) if snapshot else None
+    if meta and meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta and meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+    return headers
+
+def update_snapshot_formats(formats):
+    """
+    Records format updates this tool has sent (encora_id -> summary) in the
+    snapshot, so its items keep matching what Encora holds.
+    """
+    if not formats or not config.collection_snapshot_enabled:
+        return
+    snapshot = read_snapshot_file()
+    if snapshot is None:
+        return
+    formats = {str(encora_id): summary for encora_id, summary in formats.items()}
+    changed = False
+    for item in snapshot['items']:
+        recording_id = item_id(item)
+        if recording_id in formats and item.get('format') != formats[recording_id]:
+            item['format'] = formats[recording_id]
+            changed = True
+    if not changed:
+        return
+
+    known = {item_id(item): item for item in snapshot['items']}
+    for meta in snapshot['pages'].values():
+        if any(recording_id in formats for recording_id in meta['ids']):
+            meta['checksum'] = page_checksum([known[recording_id] for recording_id in meta['ids'] if recording_id in known])
+    write_snapshot_file(snapshot)
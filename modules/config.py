@@ -41,6 +41,84 @@ class Config:
     def collection_page_size(self):
         return int(self.get('COLLECTION_PAGE_SIZE', '100'))
 
+    @property
+    def nested_recording_ids(self):
+        return self.get('NESTED_RECORDING_IDS', 'false').lower() == 'true'
+
+    @property
+    def scan_workers(self):
+        return int(self.get('SCAN_WORKERS', '8'))
+
+    @property
+    def scan_workers_per_device(self):
+        return int(self.get('SCAN_WORKERS_PER_DEVICE', '4'))
+
+    @property
+    def scan_cache_enabled(self):
+        return self.get('SCAN_CACHE', 'true').lower() == 'true'
+
+    @property
+    def scan_cache_path(self):
+        default_path = os.path.join(os.path.dirname(os.path.abspath(self.env_path)), 'scan_cache.sqlite')
+        return self.get('SCAN_CACHE_PATH', default_path)
+
+    @property
+    def collection_snapshot_enabled(self):
+        return self.get('COLLECTION_SNAPSHOT', 'true').lower() == 'true'
+
+    @property
+    def collection_snapshot_path(self):
+        default_path = os.path.join(os.path.dirname(os.path.abspath(self.env_path)), 'collection_snapshot.json')
+        return self.get('COLLECTION_SNAPSHOT_PATH', default_path)
+
+    @property
+    def collection_full_sync_hours(self):
+        return float(self.get('COLLECTION_FULL_SYNC_HOURS', '168'))
+
+    @property
+    def collect_retry_path(self):
+        default_path = os.path.join(os.path.dirname(os.path.abspath(self.env_path)), 'collect_retry.json')
+        return self.get('COLLECT_RETRY_PATH', default_path)
+
+    @property
+    def format_journal_path(self):
+        default_path = os.path.join(os.path.dirname(os.path.abspath(self.env_path)), 'format_queue.jsonl')
+        return self.get('FORMAT_JOURNAL_PATH', default_path)
+
+    @property
+    def collect_batch_size(self):
+        return int(self.get('COLLECT_BATCH_SIZE', '50'))
+
+    @property
+    def subtitle_index_sidecar(self):
+        return self.get('SUBTITLE_INDEX_SIDECAR', 'false').lower() == 'true'
+
+    @property
+    def subtitle_manifest_path(self):
+        default_path = os.path.join(os.path.dirname(os.path.abspath(self.env_path)), 'subtitle_manifest.json')
+        return self.get('SUBTITLE_MANIFEST_PATH', default_path)
+
+    @property
+    def subtitle_chunk_size(self):
+        return int(self.get('SUBTITLE_CHUNK_SIZE', '100'))
+
+    @property
+    def api_workers(self):
+        return int(self.get('API_WORKERS', '4'))
+
+    @property
+    def move_journal_path(self):
+        default_path = os.path.join(os.path.dirname(os.path.abspath(self.env_path)), 'move_journal.jsonl')
+        return self.get('MOVE_JOURNAL_PATH', default_path)
+
+    @property
+    def move_workers(self):
+        return int(self.get('MOVE_WORKERS', '4'))
+
+    @property
+    def move_verify(self):
+        return self.get('MOVE_VERIFY', 'size').lower()
+
     @property
     def show_folder_format(self):
         return self.get('SHOW_FOLDER_FORMAT')
@@ -1,6 +1,11 @@
+import atexit
+import json
 import os
 import difflib
+import hashlib
 import re
+import threading
+from collections import OrderedDict
 
 def get_diff_file_path(filename):
     """
@@ -10,11 +15,71 @@ def get_diff_file_path(filename):
     root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     return os.path.join(root_dir, filename)
 
+# Structured copy of every report entry, one JSON object per line
+RUN_LOG_FILE = 'run_log.jsonl'
+
+# Table headers for the reports that have them
+REPORT_HEADERS = {
+    'missing_smalls.txt': (
+        f"{'Recording ID':<15} | {'Show':<30} | {'Tour':<20} | {'Date':<20} | {'Master':<20}\n"
+        f"{'-'*15}-+-{'-'*30}-+-{'-'*20}-+-{'-'*20}-+-{'-'*20}\n"
+    ),
+    'subtitle_downloads.txt': (
+        f"{'Recording ID':<15} | {'File':<60} | Result\n"
+        f"{'-'*15}-+-{'-'*60}-+-{'-'*30}\n"
+    ),
+}
+
+class ReportWriter:
+    """
+    Buffers the run's report entries in memory and writes them in bulk, so a
+    large run opens each report file once per stage instead of once per entry.
+
+    Every entry is written both to its human-readable report file and, as a
+    JSON object tagged with the report name, to run_log.jsonl for tooling.
+    Entries are flushed at stage boundaries and when the process exits.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._text = {}  # Report file name -> [text]
+        self._records = []
+
+    def add(self, filename, text, record):
+        with self._lock:
+            self._text.setdefault(filename, []).append(text)
+            self._records.append({'report': os.path.splitext(filename)[0], **record})
+
+    def flush(self):
+        """Appends everything buffered so far to the report files."""
+        with self._lock:
+            text, records = self._text, self._records
+            self._text, self._records = {}, []
+
+        for filename, entries in text.items():
+            file_path = get_diff_file_path(filename)
+            header_needed = filename in REPORT_HEADERS and not os.path.exists(file_path)
+            with open(file_path, 'a', encoding='utf-8') as f:
+                if header_needed:
+                    f.write(REPORT_HEADERS[filename])
+                f.write(''.join(entries))
+
+        if records:
+            with open(get_diff_file_path(RUN_LOG_FILE), 'a', encoding='utf-8') as f:
+                f.write(''.join(json.dumps(record, default=str) + '\n' for record in records))
+
+report_writer = ReportWriter()
+atexit.register(report_writer.flush)
+
+def flush_reports():
+    """Writes out the buffered report entries; called at the end of each stage."""
+    report_writer.flush()
+
 def clear_diff_files():
     """
     Clears the diff and log files at the start of a run.
     """
-    for filename in ['cast_diffs.txt', 'subtitle_diffs.txt', 'missing_smalls.txt']:
+    for filename in ['cast_diffs.txt', 'subtitle_diffs.txt', 'missing_smalls.txt', 'subtitle_downloads.txt', RUN_LOG_FILE]:
         file_path = get_diff_file_path(filename)
         if os.path.exists(file_path):
             os.remove(file_path)
@@ -23,79 +88,126 @@ def log_missing_smalls(recording_id, show, tour, date, master):
     """
     Logs a recording with missing smalls to missing_smalls.txt.
     """
-    file_path = get_diff_file_path('missing_smalls.txt')
-    header_needed = not os.path.exists(file_path)
-    
-    with open(file_path, 'a', encoding='utf-8') as f:
-        if header_needed:
-            f.write(f"{'Recording ID':<15} | {'Show':<30} | {'Tour':<20} | {'Date':<20} | {'Master':<20}\n")
-            f.write(f"{'-'*15}-+-{'-'*30}-+-{'-'*20}-+-{'-'*20}-+-{'-'*20}\n")
-        
-        f.write(f"{str(recording_id):<15} | {str(show):<30} | {str(tour):<20} | {str(date):<20} | {str(master):<20}\n")
+    report_writer.add(
+        'missing_smalls.txt',
+        f"{str(recording_id):<15} | {str(show):<30} | {str(tour):<20} | {str(date):<20} | {str(master):<20}\n",
+        {'recording_id': recording_id, 'show': show, 'tour': tour, 'date': date, 'master': master}
+    )
 
-def are_functionally_identical(content1, content2):
+def log_subtitle_download(recording_id, file_name, size_bytes, seconds, error=None):
     """
-    Checks if two strings (or bytes) are functionally identical,
-    ignoring line endings, trailing whitespace, and BOM.
+    Logs one subtitle download, with its throughput or error, to subtitle_downloads.txt.
     """
-    if isinstance(content1, bytes):
-        try:
-            content1 = content1.decode('utf-8-sig')
-        except UnicodeDecodeError:
-            content1 = content1.decode('utf-8', errors='ignore')
-    if isinstance(content2, bytes):
+    if error:
+        result = f"FAILED: {error}"
+    else:
+        rate = size_bytes / seconds / 1024 if seconds > 0 else 0
+        result = f"{size_bytes} B in {seconds:.2f}s ({rate:.1f} KB/s)"
+
+    report_writer.add(
+        'subtitle_downloads.txt',
+        f"{str(recording_id):<15} | {file_name:<60} | {result}\n",
+        {'recording_id': recording_id, 'file': file_name, 'size_bytes': size_bytes, 'seconds': seconds, 'error': error}
+    )
+
+def decode_content(content):
+    """Decodes bytes as UTF-8 (dropping any BOM), ignoring undecodable bytes."""
+    if isinstance(content, bytes):
         try:
-            content2 = content2.decode('utf-8-sig')
+            return content.decode('utf-8-sig')
         except UnicodeDecodeError:
-            content2 = content2.decode('utf-8', errors='ignore')
+            return content.decode('utf-8', errors='ignore')
+    return content
 
-    def clean_content(content):
+# Time markers with more than two decimal places (e.g. 00:00:00.000 -> 00:00:00.00)
+HMS_FRACTION_PATTERN = re.compile(r'(\d+:\d+:\d+)\.(\d{2})\d*')
+MS_FRACTION_PATTERN = re.compile(r'(\d+:\d+)\.(\d{2})\d*')
+AEGISUB_GARBAGE_HEADER = '[Aegisub Project Garbage]'
+
+# Fingerprints of recently seen content, keyed on a hash of the raw bytes
+FINGERPRINT_CACHE_SIZE = 4096
+_fingerprint_cache = OrderedDict()
+_fingerprint_lock = threading.Lock()
+
+def clean_content(content):
+    """
+    Normalises subtitle or text content for comparison, ignoring line endings,
+    whitespace, blank lines, Aegisub project garbage and time marker precision.
+    Returns the list of cleaned lines.
+    """
+    cleaned_lines = []
+    skip_section = False
+    hms_sub = HMS_FRACTION_PATTERN.sub
+    ms_sub = MS_FRACTION_PATTERN.sub
+
+    for line in decode_content(content).splitlines():
         # Normalize line endings and strip whitespace
-        lines = [line.strip() for line in content.splitlines()]
-        
-        # Filter out Aegisub Project Garbage and empty lines
-        cleaned_lines = []
-        skip_section = False
-        for line in lines:
-            # Skip Aegisub garbage
-            if line == '[Aegisub Project Garbage]':
-                skip_section = True
-                continue
-            if skip_section and line.startswith('['):
-                skip_section = False
-            
-            if skip_section:
-                continue
+        line = line.strip()
 
-            # Ignore empty lines entirely for comparison
-            if not line:
+        # Skip Aegisub garbage
+        if line == AEGISUB_GARBAGE_HEADER:
+            skip_section = True
+            continue
+        if skip_section:
+            if not line.startswith('['):
                 continue
-            
-            # Normalize common time markers (e.g. 00:00:00.000 -> 00:00:00.00)
-            # This handles cases where one source has more decimal precision
-            line = re.sub(r'(\d+:\d+:\d+)\.(\d{2})\d*', r'\1.\2', line)
-            line = re.sub(r'(\d+:\d+)\.(\d{2})\d*', r'\1.\2', line)
-            
-            # Normalize all internal whitespace (collapse multiple spaces, tabs, non-breaking spaces)
-            line = ' '.join(line.split())
-            
-            # Remove minor punctuation differences that often vary between sources
-            # such as spaces after commas in time-markers or brackets
+            skip_section = False
+
+        # Ignore empty lines entirely for comparison
+        if not line:
+            continue
+
+        # Normalize common time markers; only lines with both characters can contain one.
+        # This handles cases where one source has more decimal precision
+        if '.' in line and ':' in line:
+            line = ms_sub(r'\1.\2', hms_sub(r'\1.\2', line))
+
+        # Normalize all internal whitespace (collapse multiple spaces, tabs, non-breaking spaces)
+        line = ' '.join(line.split())
+
+        # Remove minor punctuation differences that often vary between sources
+        # such as spaces after commas in time-markers or brackets
+        if ',' in line:
             line = line.replace(', ', ',').replace(' ,', ',')
-            
-            cleaned_lines.append(line)
-        
-        return cleaned_lines
 
-    return clean_content(content1) == clean_content(content2)
+        cleaned_lines.append(line)
+
+    return cleaned_lines
+
+def content_fingerprint(content):
+    """
+    Returns a stable hash of the normalised content. Two files have the same
+    fingerprint exactly when are_functionally_identical considers them equal.
+    Content seen recently is looked up by a hash of its raw bytes instead of
+    being normalised again.
+    """
+    raw = content if isinstance(content, bytes) else content.encode('utf-8', errors='surrogatepass')
+    key = (isinstance(content, bytes), hashlib.blake2b(raw, digest_size=16).digest())
+    with _fingerprint_lock:
+        fingerprint = _fingerprint_cache.get(key)
+        if fingerprint is not None:
+            _fingerprint_cache.move_to_end(key)
+            return fingerprint
+
+    fingerprint = hashlib.sha256('\n'.join(clean_content(content)).encode('utf-8', errors='surrogatepass')).hexdigest()
+    with _fingerprint_lock:
+        _fingerprint_cache[key] = fingerprint
+        if len(_fingerprint_cache) > FINGERPRINT_CACHE_SIZE:
+            _fingerprint_cache.popitem(last=False)
+    return fingerprint
+
+def are_functionally_identical(content1, content2):
+    """
+    Checks if two strings (or bytes) are functionally identical,
+    ignoring line endings, trailing whitespace, and BOM.
+    """
+    return content_fingerprint(content1) == content_fingerprint(content2)
 
 def append_to_diff_file(diff_file_name, recording_id, old_content, new_content, label):
     """
     Appends a unified diff between old_content and new_content to a diff file.
     Only records changes that are not just whitespace or line ending differences.
     """
-    diff_file_path = get_diff_file_path(diff_file_name)
-    
     # Ensure contents are strings
     if isinstance(old_content, bytes):
         try:
@@ -128,11 +240,13 @@ def append_to_diff_file(diff_file_name, recording_id, old_content, new_content,
     
     diff_text = list(diff)
     if diff_text:
-        with open(diff_file_path, 'a', encoding='utf-8') as f:
-            f.write(f"{'='*60}\n")
-            f.write(f"Recording ID: {recording_id}\n")
-            f.write(f"File: {label}\n")
-            f.write(f"{'-'*60}\n")
-            for line in diff_text:
-                f.write(line + "\n")
-            f.write("\n")
+        report_writer.add(
+            diff_file_name,
+            f"{'='*60}\n"
+            f"Recording ID: {recording_id}\n"
+            f"File: {label}\n"
+            f"{'-'*60}\n"
+            + ''.join(line + "\n" for line in diff_text)
+            + "\n",
+            {'recording_id': recording_id, 'file': label, 'diff': diff_text}
+        )
@@ -1,16 +1,22 @@
+import asyncio
 import hashlib
+import json
 import os
 import requests
 from tqdm import tqdm
 import re
 import time
 from modules.config import config
-from modules.api_utils import authenticated_request
-from modules.diff_utils import append_to_diff_file, are_functionally_identical
+from modules.async_api import AsyncEncoraClient
+from modules.diff_utils import append_to_diff_file, content_fingerprint, log_subtitle_download
+from modules.manage_file_sizes import get_file_size
+from modules.subtitle_manifest import (
+    describes, is_unchanged, load_subtitle_manifest, manifest_entry, matches_local_file,
+    revalidation_headers, save_subtitle_manifest
+)
+from modules.inventory import LibraryInventory
 
 
-api_key = config.api_key
-
 def get_encora_id_from_folder(folder_name):
     """Extract Encora ID from the folder name (handles various containers)."""
     match = re.search(r'[\{\[\(]e-(\d+)[\}\]\)]', folder_name)
@@ -148,153 +154,482 @@ def file_content_hash(file_path):
             sha256.update(chunk)
     return sha256.hexdigest()
 
-def download_all_subtitles(recording_ids_with_subtitles):
+SUBTITLE_EXTENSIONS = ('.ass', '.srt', '.vtt', '.sub', '.sbv')
+
+def group_subtitles(subtitles_data):
+    """Group subtitles by recording_id."""
+    subtitles_by_recording_id = {}
+    for subtitle in subtitles_data:
+        recording_id = str(subtitle['recording_id'])
+        if recording_id not in subtitles_by_recording_id:
+            subtitles_by_recording_id[recording_id] = []
+        subtitles_by_recording_id[recording_id].append(subtitle)
+    return subtitles_by_recording_id
+
+def subtitle_uid(subtitle):
+    """Returns a stable unique ID for a subtitle."""
+    # Try to find a unique ID (Encora uses 'id' or 'subtitle_id' in different contexts)
+    sub_uid = subtitle.get('id') or subtitle.get('subtitle_id')
+    if not sub_uid:
+        # Use a stable hash of the URL if no ID is provided by the API
+        sub_uid = hashlib.md5(subtitle['url'].encode()).hexdigest()[:8]
+    return str(sub_uid)
+
+def subtitle_file_name(subtitle):
+    """Builds the local file name for a subtitle: Author [Coverage] {Hash}.lang.ext"""
+    # Prepare the filename
+    lang_code = language_code_mapping.get(subtitle['language'], subtitle['language'][:2].lower())
+    author = subtitle.get('author', 'Unknown')
+    # Sanitise author name for filesystem
+    author_sanitised = re.sub(r'[<>:"/\\|?*]', '_', author).strip()
+    
+    # Determine Coverage
+    coverage = subtitle.get('coverage', '')
+    if coverage:
+        # Format "act-1" to "Act 1", "complete" to "Complete"
+        formatted_coverage = coverage.replace('-', ' ').title()
+        coverage_str = f" [{formatted_coverage}]"
+    else:
+        # Fallback to notes parsing
+        note = subtitle.get('notes', '') or ''
+        act_match = re.search(r'(Act\s*\d+|Part\s*\d+)', note, re.I)
+        if act_match:
+            coverage_str = f" [{act_match.group(1).title()}]"
+        else:
+            coverage_str = ""
+
+    sub_uid = subtitle_uid(subtitle)
+    ext = subtitle['file_type'].lower()
+    return f"{author_sanitised}{coverage_str} {{{sub_uid}}}.{lang_code}.{ext}"
+
+# Subtitle files are streamed to disk in chunks of this size
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+def stream_subtitle(client, url, tmp_path, headers=None):
+    """
+    Streams a subtitle file to tmp_path on the pooled client, sending any
+    conditional headers given. Returns (size_bytes, seconds, validators), where
+    validators holds the response's ETag and Last-Modified, or None if the
+    server answered 304 Not Modified. A partial file is removed on failure.
+    """
+    start = time.monotonic()
+    size = 0
+    try:
+        response = client.get(url, stream=True, timeout=10, headers=headers or None)
+        try:
+            if response.status_code == 304:
+                return None
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+                    size += len(chunk)
+            validators = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+        finally:
+            response.close()
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return size, time.monotonic() - start, validators
+
+# Hidden per-folder copy of the subtitle index, written when SUBTITLE_INDEX_SIDECAR is on
+SIDECAR_NAME = '.subtitle_index.json'
+
+class SubtitleIndex:
+    """
+    Normalised-content fingerprints of the subtitles in each recording folder.
+
+    A folder is fingerprinted the first time it is looked up, so checking a
+    download for a duplicate is one hash lookup instead of re-reading and
+    re-normalising every subtitle in the folder. Files written or renamed
+    through the index keep it current. With SUBTITLE_INDEX_SIDECAR enabled the
+    fingerprints are also kept in a hidden sidecar in each folder, and files
+    whose size and mtime haven't changed are not read again on the next run.
+    """
+
+    def __init__(self, inventory=None, sidecars=None):
+        self.inventory = inventory
+        self.sidecars = config.subtitle_index_sidecar if sidecars is None else sidecars
+        self._folders = {}  # Folder key -> {file name: (size, mtime_ns, fingerprint)}
+        self._by_fingerprint = {}  # Folder key -> {fingerprint: file name}
+        self._paths = {}  # Folder key -> folder path
+        self._dirty = set()
+
+    @staticmethod
+    def _key(folder_path):
+        return os.path.normcase(os.path.normpath(folder_path))
+
+    def _file_stat(self, file_path):
+        folder = self.inventory.get(os.path.dirname(file_path)) if self.inventory is not None else None
+        details = folder.files.get(os.path.basename(file_path)) if folder is not None else None
+        if details and details[1] is not None:
+            return details
+        stat = os.stat(file_path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def _load_sidecar(self, folder_path):
+        if not self.sidecars:
+            return {}
+        try:
+            with open(os.path.join(folder_path, SIDECAR_NAME), 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            return {name: tuple(entry) for name, entry in entries.items()}
+        except (OSError, ValueError, TypeError, AttributeError):
+            return {}
+
+    def _folder(self, folder_path):
+        key = self._key(folder_path)
+        if key in self._folders:
+            return key
+
+        if self.inventory is not None and folder_path in self.inventory:
+            names = self.inventory.file_names(folder_path)
+        else:
+            names = os.listdir(folder_path)
+        cached = self._load_sidecar(folder_path)
+
+        entries = {}
+        for name in names:
+            if not name.lower().endswith(SUBTITLE_EXTENSIONS):
+                continue
+            file_path = os.path.join(folder_path, name)
+            try:
+                size, mtime_ns = self._file_stat(file_path)
+                entry = cached.get(name)
+                if entry is None or entry[0] != size or entry[1] != mtime_ns:
+                    with open(file_path, 'rb') as f:
+                        entry = (size, mtime_ns, content_fingerprint(f.read()))
+                    self._dirty.add(key)
+                entries[name] = tuple(entry)
+            except Exception:
+                continue
+        if set(cached) != set(entries):
+            self._dirty.add(key)
+
+        self._folders[key] = entries
+        self._paths[key] = folder_path
+        self._by_fingerprint[key] = {}
+        for name, (_, _, fingerprint) in entries.items():
+            # The first file in listing order wins, as in a scan of the folder
+            self._by_fingerprint[key].setdefault(fingerprint, name)
+        return key
+
+    def find(self, folder_path, fingerprint):
+        """Returns the name of a subtitle in the folder with this fingerprint, or None."""
+        return self._by_fingerprint[self._folder(folder_path)].get(fingerprint)
+
+    def _forget(self, key, name):
+        entry = self._folders[key].pop(name, None)
+        if entry is not None and self._by_fingerprint[key].get(entry[2]) == name:
+            del self._by_fingerprint[key][entry[2]]
+            # Fall back to another file with the same content, if there is one
+            for other_name, other_entry in self._folders[key].items():
+                if other_entry[2] == entry[2]:
+                    self._by_fingerprint[key][entry[2]] = other_name
+                    break
+
+    def add(self, file_path, fingerprint):
+        """Records a subtitle that has just been written."""
+        key = self._folder(os.path.dirname(file_path))
+        name = os.path.basename(file_path)
+        self._forget(key, name)
+        size, mtime_ns = self._file_stat(file_path)
+        self._folders[key][name] = (size, mtime_ns, fingerprint)
+        self._by_fingerprint[key].setdefault(fingerprint, name)
+        self._dirty.add(key)
+
+    def rename(self, old_path, new_path):
+        """Records a subtitle that has just been renamed within its folder."""
+        key = self._folder(os.path.dirname(old_path))
+        entry = self._folders[key].get(os.path.basename(old_path))
+        self._forget(key, os.path.basename(old_path))
+        if entry is not None:
+            self.add(new_path, entry[2])
+
+    def save(self):
+        """Writes the sidecar of every folder whose index has changed."""
+        if not self.sidecars:
+            return
+        for key in self._dirty:
+            entries = self._folders.get(key)
+            if entries is None:
+                continue
+            sidecar_path = os.path.join(self._paths[key], SIDECAR_NAME)
+            try:
+                with open(sidecar_path, 'w', encoding='utf-8') as f:
+                    json.dump({name: list(entry) for name, entry in entries.items()}, f)
+                if self.inventory is not None:
+                    self.inventory.add_file(sidecar_path)
+            except OSError as e:
+                print(f"Warning: Could not save subtitle index in {self._paths[key]}: {e}")
+        self._dirty.clear()
+
+def save_subtitle(recording_id, download_directory, file_name, downloaded_path, inventory=None, subtitle_index=None):
+    """
+    Moves a downloaded subtitle into place with an atomic rename, unless a
+    matching copy is already in the folder, in which case that copy is renamed
+    to the standard name and the download is discarded.
+    Returns True if a file was written or renamed.
+    """
+    if subtitle_index is None:
+        subtitle_index = SubtitleIndex(inventory, sidecars=False)
+    file_path = os.path.join(download_directory, file_name)
+    with open(downloaded_path, 'rb') as f:
+        new_content = f.read()
+
+    # A single lookup finds any existing file in the directory with matching content
+    fingerprint = content_fingerprint(new_content)
+    existing_name = subtitle_index.find(download_directory, fingerprint)
+
+    if existing_name is not None:
+        os.remove(downloaded_path)
+        # If the content matches but the name is different, rename to standard
+        if existing_name != file_name:
+            existing_matching_file_path = os.path.join(download_directory, existing_name)
+            try:
+                os.rename(existing_matching_file_path, file_path)
+                if inventory is not None:
+                    inventory.rename_file(existing_matching_file_path, file_path)
+                subtitle_index.rename(existing_matching_file_path, file_path)
+                return True
+            except Exception as e:
+                print(f"Error renaming local subtitle: {e}")
+        return False
+
+    if os.path.exists(file_path):
+        # Record the difference before overwriting
+        with open(file_path, 'rb') as f:
+            old_content_bytes = f.read()
+        append_to_diff_file('subtitle_diffs.txt', recording_id, old_content_bytes, new_content, file_path)
+
+    # Readers only ever see the old file or the complete new one
+    os.replace(downloaded_path, file_path)
+    if inventory is not None:
+        inventory.add_file(file_path)
+    subtitle_index.add(file_path, fingerprint)
+    return True
+
+def report_subtitle_downloads(downloads, updated_subs, elapsed):
+    """Logs every download to subtitle_downloads.txt and prints the totals and failures."""
+    for download in downloads:
+        log_subtitle_download(**download)
+
+    fetched = [download for download in downloads if not download['error']]
+    failed = [download for download in downloads if download['error']]
+    if fetched:
+        total_bytes = sum(download['size_bytes'] for download in fetched)
+        rate = get_file_size(int(total_bytes / elapsed)) if elapsed > 0 else "-"
+        print(f"Fetched {len(fetched)} subtitle files ({get_file_size(total_bytes)}) in {elapsed:.1f}s ({rate}/s).")
+    if failed:
+        print(f"{len(failed)} subtitle downloads failed:")
+        for download in failed:
+            print(f"  {download['recording_id']}: {download['file_name']} ({download['error']})")
+
+    if updated_subs > 0:
+        print(f"Downloaded/Updated {updated_subs} subtitle files.")
+    else:
+        print("All local subtitles are already up to date.")
+
+def download_all_subtitles(recording_ids_with_subtitles, inventory=None):
     """Download subtitles for the given Encora IDs."""
+    asyncio.run(download_all_subtitles_async(AsyncEncoraClient(), recording_ids_with_subtitles, inventory))
+
+async def download_all_subtitles_async(api, recording_ids_with_subtitles, inventory=None):
+    """
+    Downloads subtitles for the given Encora IDs on an AsyncEncoraClient.
+
+    The subtitle lists are requested in chunks of SUBTITLE_CHUNK_SIZE IDs,
+    concurrently, so no request URL grows with the size of the library and a
+    failed chunk only loses its own recordings. Each chunk's files start
+    downloading as soon as its list arrives. Up to API_WORKERS requests are
+    in flight at once; files stream to hidden .part files in their recording
+    folders and are renamed into place as soon as they finish.
+
+    The subtitle manifest records what was downloaded. A subtitle whose
+    updated_at on Encora is unchanged, and whose local copy still matches the
+    manifest, is skipped; without an updated_at it is revalidated with a
+    conditional request instead. Local subtitles that Encora no longer lists
+    are reported.
+    """
     if not recording_ids_with_subtitles:
         return
 
-    # Extract all recording IDs
-    recording_ids = [item[0] for item in recording_ids_with_subtitles]
-    ids_str = ','.join(recording_ids)
-    
-    subtitles_url = f"https://encora.it/api/subtitles/{ids_str}"
-    headers = {'Authorization': f'Bearer {api_key}', "User-Agent": "BootOrganiser"}
-    
-    try:
-        response = authenticated_request('GET', subtitles_url, headers=headers)
-        subtitles_data = response.json()
-
-        # Group subtitles by recording_id
-        subtitles_by_recording_id = {}
-        for subtitle in subtitles_data:
-            recording_id = str(subtitle['recording_id'])
-            if recording_id not in subtitles_by_recording_id:
-                subtitles_by_recording_id[recording_id] = []
-            subtitles_by_recording_id[recording_id].append(subtitle)
-
-        updated_subs = 0
-        for recording_id, folder_path in tqdm(recording_ids_with_subtitles, desc="Downloading non-matching subtitles"):
-            if recording_id in subtitles_by_recording_id:
-                subtitles = subtitles_by_recording_id[recording_id]
-                download_directory = folder_path
-
-                for subtitle in subtitles:
-                    subtitle_url = subtitle['url']
-                    # Prepare the filename
-                    lang_code = language_code_mapping.get(subtitle['language'], subtitle['language'][:2].lower())
-                    author = subtitle.get('author', 'Unknown')
-                    # Sanitise author name for filesystem
-                    author_sanitised = re.sub(r'[<>:"/\\|?*]', '_', author).strip()
-                    
-                    # Determine Coverage
-                    coverage = subtitle.get('coverage', '')
-                    if coverage:
-                        # Format "act-1" to "Act 1", "complete" to "Complete"
-                        formatted_coverage = coverage.replace('-', ' ').title()
-                        coverage_str = f" [{formatted_coverage}]"
+    folders_by_recording_id = {}
+    for recording_id, folder_path in recording_ids_with_subtitles:
+        folders_by_recording_id.setdefault(recording_id, []).append(folder_path)
+    recording_ids = list(folders_by_recording_id)
+    chunk_size = max(1, config.subtitle_chunk_size)
+    chunks = [recording_ids[i:i + chunk_size] for i in range(0, len(recording_ids), chunk_size)]
+
+    failed_chunks = []
+    downloads = []
+    updated_subs = 0
+    unchanged_subs = 0
+    removed_upstream = []
+    subtitle_index = SubtitleIndex(inventory)
+    manifest = load_subtitle_manifest()
+
+    def is_present(folder_path, file_name):
+        file_path = os.path.join(folder_path, file_name)
+        if inventory is not None and folder_path in inventory:
+            return inventory.has_file(file_path)
+        return os.path.exists(file_path)
+
+    def local_size(folder_path, file_name):
+        """Size of a local subtitle, from the inventory where it has the folder, or None if it's missing."""
+        folder = inventory.get(folder_path) if inventory is not None else None
+        if folder is not None:
+            stat = folder.files.get(file_name)
+            return stat[0] if stat is not None else None
+        try:
+            return os.path.getsize(os.path.join(folder_path, file_name))
+        except OSError:
+            return None
+
+    async def download(recording_id, folder_path, subtitle, headers):
+        nonlocal updated_subs, unchanged_subs
+        file_name = subtitle_file_name(subtitle)
+        record = {'recording_id': recording_id, 'file_name': file_name, 'size_bytes': 0, 'seconds': 0, 'error': None}
+        tmp_path = os.path.join(folder_path, f".{file_name}.part")
+        try:
+            # Ensure the download directory exists
+            os.makedirs(folder_path, exist_ok=True)
+            result = await api.run(stream_subtitle, api.client, subtitle['url'], tmp_path, headers)
+        except (requests.exceptions.RequestException, OSError) as e:
+            record['error'] = str(e)
+            downloads.append(record)
+            return
+        finally:
+            progress.update(1)
+        if result is None:
+            # The server confirmed the local copy is current; keep the manifest's updated_at in step with Encora
+            manifest[recording_id][subtitle_uid(subtitle)]['updated_at'] = subtitle.get('updated_at')
+            unchanged_subs += 1
+            return
+        record['size_bytes'], record['seconds'], validators = result
+        downloads.append(record)
+        try:
+            if save_subtitle(recording_id, folder_path, file_name, tmp_path, inventory, subtitle_index):
+                updated_subs += 1
+            # Describe the file that was kept, which may be an existing copy with matching content
+            file_path = os.path.join(folder_path, file_name)
+            manifest.setdefault(recording_id, {})[subtitle_uid(subtitle)] = manifest_entry(
+                subtitle, file_name, os.path.getsize(file_path), file_content_hash(file_path), validators
+            )
+        except Exception as e:
+            record['error'] = f"Could not save: {e}"
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    async def download_chunk(chunk):
+        try:
+            response = await api.get(f"subtitles/{','.join(chunk)}")
+            chunk_subtitles = group_subtitles(response.json())
+        except Exception as e:
+            tqdm.write(f"Error fetching the subtitle list for {len(chunk)} recordings: {e}")
+            failed_chunks.append(chunk)
+            return
+        nonlocal unchanged_subs
+        jobs = []
+        for recording_id in chunk:
+            listed = {subtitle_uid(subtitle): subtitle for subtitle in chunk_subtitles.get(recording_id, [])}
+            known = manifest.get(recording_id, {})
+
+            # Subtitles we downloaded before that Encora no longer lists
+            for uid in [uid for uid in known if uid not in listed]:
+                removed_upstream.extend(
+                    os.path.join(folder_path, known[uid]['file_name'])
+                    for folder_path in folders_by_recording_id[recording_id]
+                    if is_present(folder_path, known[uid]['file_name'])
+                )
+                del known[uid]
+
+            for uid, subtitle in listed.items():
+                file_name = subtitle_file_name(subtitle)
+                entry = known.get(uid)
+                for folder_path in folders_by_recording_id[recording_id]:
+                    # Only skip a subtitle Encora's updated_at says is unchanged and whose local copy matches
+                    # the manifest. Without updated_at the local copy is checked by hash and revalidated with
+                    # the server's ETag or Last-Modified, and anything else is downloaded again.
+                    file_path = os.path.join(folder_path, file_name)
+                    size = local_size(folder_path, file_name)
+                    if is_unchanged(entry, subtitle, file_name) and matches_local_file(entry, file_path, size):
+                        unchanged_subs += 1
+                    elif describes(entry, subtitle, file_name) and matches_local_file(entry, file_path, size, check_hash=True):
+                        jobs.append((recording_id, folder_path, subtitle, revalidation_headers(entry)))
                     else:
-                        # Fallback to notes parsing
-                        note = subtitle.get('notes', '') or ''
-                        act_match = re.search(r'(Act\s*\d+|Part\s*\d+)', note, re.I)
-                        if act_match:
-                            coverage_str = f" [{act_match.group(1).title()}]"
-                        else:
-                            coverage_str = ""
-
-                    # Try to find a unique ID (Encora uses 'id' or 'subtitle_id' in different contexts)
-                    sub_uid = subtitle.get('id') or subtitle.get('subtitle_id')
-                    if not sub_uid:
-                        # Use a stable hash of the URL if no ID is provided by the API
-                        sub_uid = hashlib.md5(subtitle_url.encode()).hexdigest()[:8]
-                    
-                    # Generate a unique filename: Author [Coverage] {Hash}.lang.ext
-                    ext = subtitle['file_type'].lower()
-                    file_name = f"{author_sanitised}{coverage_str} {{{sub_uid}}}.{lang_code}.{ext}"
-                    file_path = os.path.join(download_directory, file_name)
-                    # Ensure the download directory exists
-                    os.makedirs(download_directory, exist_ok=True)
-
-                    # Download the subtitle file
-                    try:
-                        subtitle_response = requests.get(subtitle_url, stream=True, timeout=10)
-                        subtitle_response.raise_for_status()
-                    except (requests.exceptions.RequestException, requests.exceptions.Timeout) as e:
-                        print(f"\nSkipping subtitle due to download error: {e}")
-                        continue
-                    new_content = subtitle_response.content
-
-                    # Check if ANY existing file in the directory matches this content
-                    is_already_present = False
-                    existing_matching_file_path = None
-                    subtitle_extensions = ('.ass', '.srt', '.vtt', '.sub', '.sbv')
-                    for item in os.listdir(download_directory):
-                        if item.lower().endswith(subtitle_extensions):
-                            existing_file_path = os.path.join(download_directory, item)
-                            try:
-                                with open(existing_file_path, 'rb') as f:
-                                    existing_content_bytes = f.read()
-                                
-                                if are_functionally_identical(existing_content_bytes, new_content):
-                                    is_already_present = True
-                                    existing_matching_file_path = existing_file_path
-                                    break
-                            except Exception:
-                                continue
-
-                    if is_already_present:
-                        # If the content matches but the name is different, rename to standard
-                        if os.path.basename(existing_matching_file_path) != file_name:
-                            try:
-                                os.rename(existing_matching_file_path, file_path)
-                                updated_subs += 1
-                            except Exception as e:
-                                print(f"Error renaming local subtitle: {e}")
-                        continue
-
-                    # Write the new content to the file
-                    if os.path.exists(file_path):
-                        # Record the difference before overwriting
-                        with open(file_path, 'rb') as f:
-                            old_content_bytes = f.read()
-                        append_to_diff_file('subtitle_diffs.txt', recording_id, old_content_bytes, new_content, file_path)
-
-                    with open(file_path, 'wb') as file:
-                        file.write(new_content)
-                    updated_subs += 1
-        
-        if updated_subs > 0:
-            print(f"Downloaded/Updated {updated_subs} subtitle files.")
+                        jobs.append((recording_id, folder_path, subtitle, None))
+
+        if not jobs:
+            return
+        # The bar only appears once there is something to download
+        nonlocal progress
+        if progress is None:
+            progress = tqdm(total=len(jobs), desc="Downloading non-matching subtitles", unit="file")
         else:
-            print("All local subtitles are already up to date.")
-                
-    except Exception as e:
-        print(f"Error downloading subtitles: {e}")
-                
+            progress.total += len(jobs)
+            progress.refresh()
+        await asyncio.gather(*(download(*job) for job in jobs))
 
-def download_subtitles_for_folders(main_directory, recording_data):
-    """Recursively download subtitles for all folders in the main directory."""
-    print("Checking for missing subtitles...")
-    # Get all directories to process
-    all_folders = []
-    for root, dirs, _ in os.walk(main_directory):
-        for folder_name in dirs:
-            all_folders.append(os.path.join(root, folder_name))
+    start = time.monotonic()
+    progress = None
+    try:
+        await asyncio.gather(*(download_chunk(chunk) for chunk in chunks))
+    finally:
+        if progress is not None:
+            progress.close()
+    subtitle_index.save()
+    save_subtitle_manifest(manifest)
+
+    if unchanged_subs:
+        print(f"Skipped {unchanged_subs} subtitles that are unchanged since they were downloaded.")
+    if removed_upstream:
+        print(f"{len(removed_upstream)} local subtitles have been removed from Encora (the local copies were kept):")
+        for file_path in removed_upstream:
+            print(f"  {file_path}")
+    if failed_chunks:
+        missed = sum(len(chunk) for chunk in failed_chunks)
+        print(f"Subtitle lists for {missed} recordings could not be fetched.")
+    report_subtitle_downloads(downloads, updated_subs, time.monotonic() - start)
+
+def find_subtitle_folders(main_directory, collection, inventory=None):
+    """Returns (encora_id, folder_path) for every local recording that has subtitles on Encora."""
+    # Get all recording folders to process, without descending into them
+    recording_folders = []
+    if inventory is None:
+        inventory = LibraryInventory(main_directory).build()
+    for root, dirs, _ in inventory.walk(main_directory):
+        for folder_name in list(dirs):
+            encora_id = get_encora_id_from_folder(folder_name)
+            if encora_id:
+                recording_folders.append((encora_id, os.path.join(root, folder_name)))
+                if not config.nested_recording_ids:
+                    dirs.remove(folder_name)
 
     # Array to store recording_ids and their folder paths
     recording_ids_with_subtitles = []
 
-    for folder_path in all_folders:
-        encora_id = get_encora_id_from_folder(os.path.basename(folder_path))
+    for encora_id, folder_path in recording_folders:
+        # Find the recording entry that matches the encora_id
+        matching_recording = collection.local_entry(encora_id)
         
-        if encora_id:
-            # Find the recording entry that matches the encora_id
-            matching_recording = next((item for item in recording_data if item['encora_id'] == encora_id), None)
-            
-            if matching_recording and matching_recording.get('recording_data', {}).get('metadata', {}).get('has_subtitles', False):
-                recording_ids_with_subtitles.append((encora_id, folder_path))
+        if matching_recording and matching_recording.get('recording_data', {}).get('metadata', {}).get('has_subtitles', False):
+            recording_ids_with_subtitles.append((encora_id, folder_path))
 
     if not recording_ids_with_subtitles:
         print("No recordings found requiring subtitle downloads.")
-        return
+    return recording_ids_with_subtitles
 
-    download_all_subtitles(recording_ids_with_subtitles)
+def download_subtitles_for_folders(main_directory, collection, inventory=None):
+    """Recursively download subtitles for all folders in the main directory."""
+    print("Checking for missing subtitles...")
+    if inventory is None:
+        inventory = LibraryInventory(main_directory).build()
+    download_all_subtitles(find_subtitle_folders(main_directory, collection, inventory), inventory)
+
+async def download_subtitles_for_folders_async(api, main_directory, collection, inventory=None):
+    """Async version of download_subtitles_for_folders."""
+    print("Checking for missing subtitles...")
+    if inventory is None:
+        inventory = LibraryInventory(main_directory).build()
+    await download_all_subtitles_async(api, find_subtitle_folders(main_directory, collection, inventory), inventory)
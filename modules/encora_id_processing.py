@@ -1,142 +1,330 @@
 import os
-import re
+import json
+import math
+import asyncio
 import time
-import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 from time import sleep
 from modules.config import config
-from modules.api_utils import authenticated_request
-
-# Define regex patterns to extract Encora ID from folder names (strictly requires 'e-' prefix)
-e_id_pattern = re.compile(r'[\{\[\(]e-(\d+)[\}\]\)]')
-
-def find_local_encora_ids(main_directory):
-    encora_ids = []
-    
-    # Loop through all subfolders in main_directory
-    for root, dirs, _ in os.walk(main_directory):
-        for dir_name in dirs:
-            folder_path = os.path.join(root, dir_name)
-            encora_id = None
-
-            # 1. Prioritise folder name regex patterns (strictly requiring 'e-')
-            if match := e_id_pattern.search(dir_name):
-                encora_id = match.group(1)
-            elif match := re.search(r'e-(\d+)', dir_name):
-                encora_id = match.group(1)
-
-            # 2. Fallback to hidden .encora-ID files ONLY if folder name has no ID
-            if not encora_id:
+from modules.api_utils import get_client
+from modules.collection_snapshot import (
+    conditional_headers, item_id, load_collection_snapshot, page_checksum, save_collection_snapshot, snapshot_page
+)
+from modules.inventory import LibraryInventory
+
+def find_local_encora_ids(main_directory, inventory=None):
+    if inventory is None:
+        inventory = LibraryInventory(main_directory).build()
+    return inventory.recordings(main_directory)
+
+COLLECTION_URL = "https://encora.it/api/collection"
+PAGE_RETRIES = 3
+
+def fetch_collection_page(client, page, page_size, timeout=30, headers=None):
+    """
+    Fetches one page of the collection. Returns (page_data, response_headers),
+    with page_data None if a conditional request came back 304 Not Modified.
+    """
+    response = client.get(f"{COLLECTION_URL}?per_page={page_size}&page={page}", timeout=timeout, headers=headers)
+    if response.status_code == 304:
+        return None, response.headers
+    data = response.json()
+    if 'data' not in data:
+        raise ValueError(f"Unexpected API response format on page {page}")
+    return data, response.headers
+
+def get_page_count(first_page, page_size):
+    """Works out how many pages the collection has from the first page, if the API says."""
+    if first_page.get('last_page'):
+        return int(first_page['last_page'])
+    if first_page.get('total') is not None:
+        return max(1, math.ceil(int(first_page['total']) / page_size))
+    return None
+
+def get_page_workers(headers):
+    """Caps the page workers so the parallel burst stays within the remaining rate limit."""
+    workers = max(1, config.api_workers)
+    remaining = headers.get('X-RateLimit-Remaining')
+    if remaining is not None:
+        try:
+            workers = min(workers, max(1, int(remaining) - 1))
+        except ValueError:
+            pass
+    return workers
+
+def fetch_remaining_pages(client, pages, page_size, workers, snapshot=None, log=print, progress=True):
+    """
+    Fetches the given pages concurrently, retrying each failed page on its own.
+    With a snapshot, each page is requested conditionally on the version the
+    snapshot holds, and comes back as None if it hasn't changed.
+    Returns ({page: (page_data, response_headers)}, [pages that still failed]).
+    """
+    results = {}
+    for attempt in range(PAGE_RETRIES):
+        if not pages:
+            break
+        failed = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(fetch_collection_page, client, page, page_size, headers=conditional_headers(snapshot, page)): page
+                for page in pages
+            }
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Fetching collection pages", unit="page", disable=not progress):
+                page = futures[future]
                 try:
-                    for file_name in os.listdir(folder_path):
-                        if file_name.startswith('.encora-'):
-                            id_match = re.search(r'\.encora-(\d+)', file_name)
-                            if id_match:
-                                encora_id = id_match.group(1)
-                                break
-                except (PermissionError, FileNotFoundError):
-                    pass
-
-            if encora_id:
-                encora_ids.append((encora_id, folder_path))
-    
-    return encora_ids
-
-def fetch_collection():
-    base_url = "https://encora.it/api/collection"
-    api_key = config.api_key
-    if not api_key:
-        print("Error: ENCORA_API_KEY not set.")
+                    results[page] = future.result()
+                except Exception as e:
+                    log(f"\nError fetching collection page {page}: {e}")
+                    failed.append(page)
+        pages = sorted(failed)
+        if pages and attempt < PAGE_RETRIES - 1:
+            log(f"Retrying {len(pages)} failed collection pages...")
+    return results, pages
+
+def sync_changed_pages(client, pages, page_headers, snapshot, page_size, page_count, workers, log=print, progress=True):
+    """
+    Revalidates every page after the first against the snapshot with
+    conditional requests, so an edit anywhere in the collection is picked up
+    while unchanged pages cost a 304 each. Fetched pages and their headers are
+    added to pages and page_headers. Returns the merged collection, or None if
+    a page couldn't be loaded or the result doesn't add up to the API's total.
+    """
+    fetched, failed_pages = fetch_remaining_pages(
+        client, [page for page in range(2, page_count + 1) if page not in pages], page_size, workers, snapshot, log, progress
+    )
+    if failed_pages:
+        return None
+
+    for page, (data, headers) in fetched.items():
+        if data is None:
+            data = {'data': snapshot_page(snapshot, page)}
+            if data['data'] is None:
+                return None
+            # A 304 may not repeat the validators, so keep the ones the snapshot has
+            headers = {'ETag': snapshot['pages'][str(page)].get('etag'), 'Last-Modified': snapshot['pages'][str(page)].get('last_modified')}
+        pages[page], page_headers[page] = data, headers
+
+    merged = [item for number in range(1, page_count + 1) for item in pages[number]['data']]
+    total = pages[1].get('total')
+    if total is None or len(merged) != int(total) or len({item_id(item) for item in merged}) != len(merged):
+        return None
+
+    changed = sum(
+        1 for number in range(1, page_count + 1)
+        if (snapshot['pages'].get(str(number)) or {}).get('checksum') != page_checksum(pages[number]['data'])
+    )
+    log(f"Loaded {len(merged)} recordings ({changed} of {page_count} pages changed since the last run).")
+    return merged
+
+def fetch_collection(log=print, progress=True):
+    """
+    Returns every item in the Encora collection. Messages go through log and
+    progress bars can be turned off, so the fetch can run alongside other
+    stages without mixing its output into theirs.
+    """
+    client = get_client()
+    if not client.api_key:
+        log("Error: ENCORA_API_KEY not set.")
         return []
 
-    headers = {
-        'Authorization': f'Bearer {api_key}', 
-        'User-Agent': 'BootOrganiser'
-    }
-    all_recordings = []
-    current_page = 1
-    timeout = 30
     page_size = config.collection_page_size
 
-    session = requests.Session()
-    session.headers.update(headers)
+    snapshot = load_collection_snapshot()
 
-    while True:
-        try:
-            response = authenticated_request('GET', f"{base_url}?per_page={page_size}&page={current_page}", session=session, timeout=timeout)
-            data = response.json()
+    try:
+        first_page, first_headers = fetch_collection_page(client, 1, page_size, headers=conditional_headers(snapshot))
+    except Exception as e:
+        log(f"\nError occurred fetching collection: {e}")
+        return []
 
-            if 'data' not in data:
-                print(f"\nUnexpected API response format on page {current_page}")
-                break
+    if first_page is None:
+        # Only page 1 is known to be unchanged; the rest are still revalidated below
+        first_page = {'data': snapshot_page(snapshot, 1), 'total': snapshot.get('total'), 'last_page': snapshot.get('page_count')}
+        first_headers = {'ETag': snapshot['pages']['1'].get('etag'), 'Last-Modified': snapshot['pages']['1'].get('last_modified')}
+        if first_page['data'] is None:
+            snapshot = None
+            try:
+                first_page, first_headers = fetch_collection_page(client, 1, page_size)
+            except Exception as e:
+                print(f"\nError occurred fetching collection: {e}")
+                return []
 
-            all_recordings.extend(data['data'])
-            print(f"\rPage: {current_page}, Recordings Loaded: {len(all_recordings)}", end='')
-            
-            if not data.get('next_page_url'):
-                break
-            
-            current_page += 1
+    all_recordings = list(first_page['data'])
+    page_count = get_page_count(first_page, page_size)
 
-        except Exception as e:
-            print(f"\nError occurred fetching collection: {e}")
-            break
+    if page_count is None:
+        # No page count from the API: follow next_page_url one page at a time
+        current_page, data = 1, first_page
+        while data.get('next_page_url'):
+            current_page += 1
+            try:
+                data, _ = fetch_collection_page(client, current_page, page_size)
+            except Exception as e:
+                log(f"\nError occurred fetching collection page {current_page}: {e}")
+                log("Warning: Collection is incomplete; later pages were not loaded.")
+                break
+            all_recordings.extend(data['data'])
+            if progress:
+                print(f"\rPage: {current_page}, Recordings Loaded: {len(all_recordings)}", end='')
+        if progress:
+            print() # New line after the loading indicator
+        else:
+            log(f"Loaded {len(all_recordings)} recordings from {current_page} pages.")
+        return all_recordings
 
-    print() # New line after the loading indicator
-    return all_recordings
+    pages, page_headers = {1: first_page}, {1: first_headers}
+    workers = get_page_workers(first_headers)
+    if snapshot is not None:
+        merged = sync_changed_pages(client, pages, page_headers, snapshot, page_size, page_count, workers, log, progress)
+        if merged is not None:
+            save_collection_snapshot(
+                {number: pages[number]['data'] for number in pages}, page_headers, first_page.get('total'), snapshot.get('full_sync_at')
+            )
+            return merged
+        log("Collection snapshot is out of date, fetching the full collection...")
+        pages, page_headers = {1: first_page}, {1: first_headers}
 
-def process_encora_ids(encora_data, local_ids):
-    results = []
-    api_key = config.api_key
-
-    session = requests.Session()
-    session.headers.update({
-        'Authorization': f'Bearer {api_key}', 
-        'Content-Type': 'application/json', 
-        "User-Agent": "BootOrganiser"
-    })
-
-    # Use tqdm to show progress while processing the local IDs
-    for encora_id, path in tqdm(local_ids, desc="Processing local Encora IDs"):
-        
-        matching_recording = next((r for r in encora_data if r.get('recording', {}).get('id') == int(encora_id)), None)
-        
-        if matching_recording:
-            results.append({
-                'encora_id': encora_id,
-                'path': path,  
-                'recording_data': matching_recording.get('recording', {}),
-                'my_format': matching_recording.get('format', "")
-            })
-        else:            
-            url = f"https://encora.it/api/collection/{encora_id}/collect"
-            try:
-                response = authenticated_request('POST', url, session=session)
-                
-                fetched_recording = fetch_single_recording(encora_id, session)
-                if fetched_recording:
-                    encora_data.append({'recording': fetched_recording, 'format': ""})
-                    results.append({
-                        'encora_id': encora_id,
-                        'path': path,
-                        'recording_data': fetched_recording,
-                        'my_format': ""
-                    })
-                else:
-                    print(f"\nFailed to fetch recording {encora_id} after collecting.")
-                    
-            except Exception as err:
-                 print(f"\nError collecting ID {encora_id}: {err}")
+    fetched, failed_pages = fetch_remaining_pages(
+        client, [page for page in range(2, page_count + 1)], page_size, workers, log=log, progress=progress
+    )
+    for page, (data, headers) in fetched.items():
+        pages[page], page_headers[page] = data, headers
+    for page in range(2, page_count + 1):
+        if page in pages:
+            all_recordings.extend(pages[page]['data'])
 
-    return results
+    if failed_pages:
+        log(f"Warning: Collection is incomplete; pages {', '.join(map(str, failed_pages))} could not be loaded.")
+    else:
+        save_collection_snapshot({number: pages[number]['data'] for number in pages}, page_headers, first_page.get('total'))
+    log(f"Loaded {len(all_recordings)} recordings from {page_count} pages.")
+    return all_recordings
 
-def fetch_single_recording(encora_id, session=None):
-    """Fetch details of a single recording."""
-    url = f"https://encora.it/api/recording/{encora_id}"
+async def fetch_single_recording_async(api, encora_id):
+    """Fetch details of a single recording on an AsyncEncoraClient."""
     try:
-        response = authenticated_request('GET', url, session=session)
+        response = await api.get(f"recording/{encora_id}")
         data = response.json()
-        return data.get('recording') or data # Wrap for different response shapes if needed
+        return data.get('recording') or data
     except Exception as e:
         print(f"\nError fetching recording {encora_id}: {e}")
         return None
+
+async def collect_recording_async(api, encora_id, already_collected=False):
+    """
+    Adds a recording to the collection and fetches its details. Returns
+    (recording, None) on success, or (None, failure) where failure records
+    the stage that failed and why. already_collected skips the collect call
+    for IDs whose collect succeeded on an earlier run.
+    """
+    if not already_collected:
+        try:
+            await api.post(f"collection/{encora_id}/collect", headers={'Content-Type': 'application/json'})
+        except Exception as err:
+            print(f"\nError collecting ID {encora_id}: {err}")
+            return None, {'stage': 'collect', 'error': str(err)}
+
+    fetched_recording = await fetch_single_recording_async(api, encora_id)
+    if not fetched_recording:
+        print(f"\nFailed to fetch recording {encora_id} after collecting.")
+        return None, {'stage': 'fetch', 'error': 'Recording details could not be fetched'}
+    return fetched_recording, None
+
+def load_collect_retries():
+    """Returns {encora_id: failure} for IDs the last run couldn't collect or fetch."""
+    try:
+        with open(config.collect_retry_path, 'r', encoding='utf-8') as f:
+            retries = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return retries if isinstance(retries, dict) else {}
+
+def save_collect_retries(retries):
+    """Writes the IDs still to be collected, removing the file once there are none."""
+    path = config.collect_retry_path
+    try:
+        if not retries:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(retries, f, indent=2)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Warning: Could not save collect retry file: {e}")
+
+async def collect_uncollected_ids(api, collection, local_ids):
+    """
+    Collects every local ID that isn't in the collection yet. IDs are gathered
+    up front and collected concurrently in batches of COLLECT_BATCH_SIZE under
+    the shared rate limit, and each recording is merged into the collection as
+    it arrives. Failures are written to the retry file after every batch, so
+    an interrupted or partly failed run is finished off by the next one.
+    """
+    paths = {}
+    for encora_id, path in local_ids:
+        if encora_id not in collection:
+            paths.setdefault(encora_id, path)
+    uncollected = list(paths)
+
+    previous = load_collect_retries()
+    # Entries for IDs that are now collected, or no longer local, are dropped
+    pending = {encora_id: previous[encora_id] for encora_id in uncollected if encora_id in previous}
+    if pending:
+        print(f"Retrying {len(pending)} Encora IDs that couldn't be collected last run.")
+    if not uncollected:
+        save_collect_retries(pending)
+        return 0
+
+    batch_size = max(1, config.collect_batch_size)
+    collected = 0
+    with tqdm(total=len(uncollected), desc="Collecting new Encora IDs", unit="ID") as progress:
+        async def collect(encora_id):
+            already_collected = previous.get(encora_id, {}).get('stage') == 'fetch'
+            result = await collect_recording_async(api, encora_id, already_collected)
+            progress.update(1)
+            return result
+
+        for start in range(0, len(uncollected), batch_size):
+            batch = uncollected[start:start + batch_size]
+            results = await asyncio.gather(*(collect(encora_id) for encora_id in batch))
+            for encora_id, (fetched_recording, failure) in zip(batch, results):
+                if fetched_recording:
+                    collection.add({'recording': fetched_recording, 'format': ""})
+                    pending.pop(encora_id, None)
+                    collected += 1
+                else:
+                    pending[encora_id] = {
+                        'path': paths[encora_id],
+                        'stage': failure['stage'],
+                        'error': failure['error'],
+                        'attempts': previous.get(encora_id, {}).get('attempts', 0) + 1
+                    }
+            save_collect_retries(pending)
+
+    if pending:
+        print(f"{len(pending)} Encora IDs could not be collected; they will be retried next run ({os.path.basename(config.collect_retry_path)}).")
+    return collected
+
+async def process_encora_ids_async(api, collection, local_ids):
+    """
+    Collects every unknown ID through the batched pipeline, then matches
+    local folders to the collection. Local entries keep the order of
+    local_ids. Returns the list of local entries.
+    """
+    await collect_uncollected_ids(api, collection, local_ids)
+    return match_local_folders(collection, local_ids)
+
+def match_local_folders(collection, local_ids):
+    """
+    Matches local folders to recordings already in the collection, without
+    collecting anything. Returns the list of local entries.
+    """
+    for encora_id, path in local_ids:
+        matching_recording = collection.get(encora_id)
+        if matching_recording:
+            collection.add_local(encora_id, path, matching_recording.get('recording', {}), matching_recording.get('format', ""))
+
+    return collection.local
@@ -0,0 +1,200 @@
+import json
+import os
+import queue
+import threading
+from modules.config import config
+from modules.api_utils import get_client
+from modules.manage_file_sizes import format_path, report_format_error
+
+# Updates that have failed this many times are dropped from the journal
+MAX_ATTEMPTS = 3
+
+class FormatQueue:
+    """
+    Sends Encora format updates on a small pool of worker threads while the
+    caller carries on evaluating recordings.
+
+    Every update is appended to a JSONL journal before it is queued, and
+    marked there once it has been sent or has failed, so updates left over
+    after a crash or a long rate limit stall are sent by the next run (or by
+    --formats-only). Updates resumed from the journal are held back until the
+    run has evaluated that recording: put() replaces a resumed update and
+    discard() drops it, and whatever is left is sent by close().
+
+    Only the latest summary for a recording is ever sent, and only one
+    request per recording is in flight at a time, so an older summary can
+    never overwrite a newer one on Encora.
+    """
+
+    def __init__(self, journal_path=None, workers=None, client=None):
+        self.journal_path = journal_path or config.format_journal_path
+        self.client = client or get_client()
+        self.workers = max(1, workers or config.api_workers)
+        self.sent = {}  # encora_id -> the summary Encora now holds
+        self.failed = {}  # encora_id -> summary
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._latest = {}  # encora_id -> summary still to be sent
+        self._resumed = {}  # encora_id -> summary from the journal, waiting for this run's evaluation
+        self._id_locks = {}  # encora_id -> lock held while a request for it is in flight
+        self._attempts = {}
+        self._threads = []
+        self._journal = None
+
+    def _load_journal(self):
+        """Returns {encora_id: summary} for updates the journal has no result for."""
+        pending = {}
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        encora_id, summary = str(entry['encora_id']), entry['summary']
+                    except (ValueError, KeyError, TypeError):
+                        continue  # A line cut short by a crash
+                    op = entry.get('op')
+                    if op == 'queued':
+                        if pending.get(encora_id) != summary:
+                            self._attempts.pop(encora_id, None)  # Failures of an older summary don't count
+                        pending[encora_id] = summary
+                    elif op in ('sent', 'dropped'):
+                        if op == 'dropped' or pending.get(encora_id) == summary:
+                            pending.pop(encora_id, None)
+                            self._attempts.pop(encora_id, None)
+                    elif op == 'failed' and pending.get(encora_id) == summary:
+                        self._attempts[encora_id] = self._attempts.get(encora_id, 0) + 1
+        except OSError:
+            return {}
+
+        for encora_id in list(pending):
+            if self._attempts.get(encora_id, 0) >= MAX_ATTEMPTS:
+                print(f"Giving up on format update for {encora_id} after {MAX_ATTEMPTS} failed attempts.")
+                del pending[encora_id]
+        return pending
+
+    def _write(self, op, encora_id, summary):
+        with self._lock:
+            self._journal.write(json.dumps({'op': op, 'encora_id': str(encora_id), 'summary': summary}) + '\n')
+            self._journal.flush()
+
+    def start(self):
+        """Starts the workers and loads anything the journal still has pending."""
+        self._resumed = self._load_journal()
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        if self._resumed:
+            print(f"Resuming {len(self._resumed)} format updates from the last run.")
+
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._worker, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def _enqueue(self, encora_id, summary):
+        with self._lock:
+            self._latest[encora_id] = summary
+        self._queue.put((encora_id, summary))
+
+    def put(self, encora_id, summary):
+        """Journals a format update and queues it for the workers, replacing any resumed update."""
+        encora_id = str(encora_id)
+        with self._lock:
+            if self._resumed.pop(encora_id, None) != summary:
+                self._attempts.pop(encora_id, None)  # Failures of an older summary don't count
+        self._write('queued', encora_id, summary)
+        self._enqueue(encora_id, summary)
+
+    def discard(self, encora_id):
+        """Drops a resumed update this run has found is no longer needed."""
+        encora_id = str(encora_id)
+        with self._lock:
+            summary = self._resumed.pop(encora_id, None)
+        if summary is not None:
+            self._write('dropped', encora_id, summary)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._latest) + len(self._resumed)
+
+    def _id_lock(self, encora_id):
+        with self._lock:
+            return self._id_locks.setdefault(encora_id, threading.Lock())
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            encora_id, summary = item
+            with self._id_lock(encora_id):
+                with self._lock:
+                    if self._latest.get(encora_id) != summary:
+                        continue  # Superseded by a newer summary, or already sent
+                try:
+                    # Send empty json body to satisfy some server configurations
+                    self.client.post(format_path(encora_id, summary), json={})
+                except Exception as err:
+                    report_format_error(encora_id, err)
+                    self._write('failed', encora_id, summary)
+                    with self._lock:
+                        if self._latest.get(encora_id) == summary:
+                            del self._latest[encora_id]
+                            self.failed[encora_id] = summary
+                    continue
+
+                self._write('sent', encora_id, summary)
+                with self._lock:
+                    self.sent[encora_id] = summary
+                    # Anything older for this recording is now out of date
+                    self.failed.pop(encora_id, None)
+                    if self._latest.get(encora_id) == summary:
+                        del self._latest[encora_id]
+
+    def close(self):
+        """
+        Sends the resumed updates this run didn't replace or discard, waits for
+        every queued update and stops the workers. The journal is compacted
+        down to the updates that failed, so they are retried next run. Returns
+        the (encora_id, summary) pairs Encora now holds.
+        """
+        with self._lock:
+            resumed, self._resumed = self._resumed, {}
+        for encora_id, summary in resumed.items():
+            self._enqueue(encora_id, summary)
+
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        self._compact()
+        return list(self.sent.items())
+
+    def _compact(self):
+        lines = []
+        for encora_id, summary in self.failed.items():
+            entry = {'encora_id': encora_id, 'summary': summary}
+            lines.append(json.dumps({'op': 'queued', **entry}))
+            for _ in range(self._attempts.get(encora_id, 0) + 1):
+                lines.append(json.dumps({'op': 'failed', **entry}))
+
+        try:
+            if not lines:
+                if os.path.exists(self.journal_path):
+                    os.remove(self.journal_path)
+                return
+            tmp_path = f"{self.journal_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+            os.replace(tmp_path, self.journal_path)
+        except OSError as e:
+            print(f"Warning: Could not compact the format journal: {e}")
+
+def flush_format_queue():
+    """Sends any format updates left in the journal. Returns the updates that were sent."""
+    format_queue = FormatQueue().start()
+    return format_queue.close()
@@ -0,0 +1,316 @@
+import os
+import re
+import stat
+import time
+from modules.config import config
+from modules.parallel_walk import list_directory, scan_tree
+
+# Encora ID patterns, shared by every stage that reads the inventory
+e_id_pattern = re.compile(r'[\{\[\(]e-(\d+)[\}\]\)]')
+bare_e_id_pattern = re.compile(r'e-(\d+)')
+id_file_pattern = re.compile(r'\.encora-(\d+)')
+
+# Directories touched more recently than this are rescanned on the next run, so
+# a file that was still being copied in is never cached with a partial size
+SETTLE_SECONDS = 60
+
+def detect_encora_id(dir_name, file_names=()):
+    """
+    Returns the Encora ID for a folder, preferring its name and falling back
+    to a hidden .encora-ID file inside it.
+    """
+    if match := e_id_pattern.search(dir_name):
+        return match.group(1)
+    if match := bare_e_id_pattern.search(dir_name):
+        return match.group(1)
+
+    for file_name in file_names:
+        if file_name.startswith('.encora-'):
+            if match := id_file_pattern.search(file_name):
+                return match.group(1)
+    return None
+
+class Folder:
+    """A directory in the inventory with its immediate files and subfolders."""
+    __slots__ = ('path', 'name', 'subdirs', 'files', 'encora_id', 'readable', 'mtime_ns', 'inode')
+
+    def __init__(self, path, subdirs=None, files=None, readable=True, mtime_ns=None, inode=None):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.subdirs = subdirs if subdirs is not None else []  # Folder names, in scan order
+        self.files = files if files is not None else {}  # File name -> (size, mtime_ns)
+        self.readable = readable
+        # Directory mtime and inode at scan time; None means "rescan next run"
+        self.mtime_ns = mtime_ns
+        self.inode = inode
+        self.encora_id = detect_encora_id(self.name, self.files)
+
+    def refresh_encora_id(self):
+        self.encora_id = detect_encora_id(self.name, self.files)
+
+class LibraryInventory:
+    """
+    In-memory tree of the library built from a single parallel os.scandir pass.
+
+    Every stage of the organiser reads folders, Encora IDs and file sizes from
+    here instead of walking the disk itself, and records anything it moves or
+    creates so the tree stays accurate for the stages that follow.
+    Symlinked directories are not followed, matching os.walk's default.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.normpath(root)
+        self.folders = {}
+
+    @staticmethod
+    def _key(path):
+        return os.path.normcase(os.path.normpath(path))
+
+    def _is_inside(self, path):
+        root_key = self._key(self.root)
+        key = self._key(path)
+        return key == root_key or key.startswith(root_key.rstrip(os.sep) + os.sep)
+
+    def build(self, cache=None):
+        """
+        Scans the whole library into memory. With a ScanCache, directories whose
+        mtime and inode are unchanged since the last run reuse their cached
+        listing and cost a single stat instead of a scan of their contents.
+        """
+        self.folders = {}
+        cached = cache.load_directories() if cache is not None else None
+        self._scan(self.root, cached)
+        return self
+
+    def save(self, cache):
+        """Writes the current tree to a ScanCache for the next run."""
+        cache.save_directories(
+            (key, folder.mtime_ns, folder.inode, folder.encora_id, folder.subdirs,
+             {name: list(details) for name, details in folder.files.items()})
+            for key, folder in self.folders.items() if folder.readable
+        )
+
+    def _scan(self, top, cached=None):
+        """Scan top and everything beneath it, replacing what was recorded there."""
+        settled_before = time.time_ns() - SETTLE_SECONDS * 10**9
+
+        def scan_directory(current, dir_stat):
+            # Runs on a worker thread, so it only reads shared state
+            if dir_stat is None:
+                try:
+                    dir_stat = os.stat(current, follow_symlinks=False)
+                except OSError:
+                    pass
+
+            subdir_stats = {}
+            readable = True
+            mtime_ns = dir_stat.st_mtime_ns if dir_stat else None
+            inode = dir_stat.st_ino if dir_stat else None
+            hit = cached.get(self._key(current)) if cached else None
+
+            if hit is not None and mtime_ns is not None and hit[0] == mtime_ns and hit[1] == inode:
+                subdirs, files = list(hit[2]), dict(hit[3])
+                # Symlinked directories are listed but never followed, so tell them apart from real ones
+                for name in subdirs:
+                    try:
+                        child_stat = os.stat(os.path.join(current, name), follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if stat.S_ISDIR(child_stat.st_mode):
+                        subdir_stats[name] = child_stat
+            else:
+                subdirs, files, subdir_stats, readable = list_directory(current)
+                recent = [mtime_ns or settled_before] + [file_mtime for _, file_mtime in files.values() if file_mtime is not None]
+                if max(recent) >= settled_before:
+                    mtime_ns = inode = None
+
+            folder = Folder(current, subdirs, files, readable, mtime_ns, inode)
+            children = [(os.path.join(current, name), child_stat) for name, child_stat in subdir_stats.items()]
+            return folder, children
+
+        for path, folder in scan_tree(os.path.normpath(top), scan_directory):
+            self.folders[self._key(path)] = folder
+
+    def get(self, path):
+        return self.folders.get(self._key(path))
+
+    def __contains__(self, path):
+        return self._key(path) in self.folders
+
+    def walk(self, top, topdown=True):
+        """
+        Yields (root, dirnames, filenames) for the tree under top, like os.walk.
+        Top-down callers may prune dirnames in place. Bottom-up listings are
+        taken after the children have been visited, so they reflect any
+        folders removed while walking.
+        """
+        folder = self.get(top)
+        if folder is None or not folder.readable:
+            return
+
+        dirnames = list(folder.subdirs)
+        if topdown:
+            yield folder.path, dirnames, list(folder.files)
+
+        for name in dirnames:
+            yield from self.walk(os.path.join(folder.path, name), topdown)
+
+        if not topdown:
+            yield folder.path, list(folder.subdirs), list(folder.files)
+
+    def iter_files(self, top):
+        """Yields (file_path, size, mtime_ns) for every file beneath top."""
+        for root, _, _ in self.walk(top):
+            folder = self.get(root)
+            for file_name, (size, mtime_ns) in folder.files.items():
+                yield os.path.join(root, file_name), size, mtime_ns
+
+    def file_names(self, path):
+        """Returns the names of the files directly inside path."""
+        folder = self.get(path)
+        return list(folder.files) if folder else []
+
+    def has_file(self, file_path):
+        folder = self.get(os.path.dirname(file_path))
+        return folder is not None and os.path.basename(file_path) in folder.files
+
+    def recordings(self, top=None, nested=None):
+        """
+        Returns (encora_id, path) for every folder beneath top with an Encora ID.
+        The walk stops at each recording unless nested IDs are enabled, so disc
+        and extras folders inside a recording are never searched.
+        """
+        top = top or self.root
+        nested = config.nested_recording_ids if nested is None else nested
+        found = []
+        for root, dirnames, _ in self.walk(top):
+            for name in list(dirnames):
+                folder = self.get(os.path.join(root, name))
+                if folder is not None and folder.encora_id:
+                    found.append((folder.encora_id, folder.path))
+                    if not nested:
+                        dirnames.remove(name)
+        return found
+
+    def _ensure_folder(self, path):
+        """Returns the folder for path, creating it and any missing parents."""
+        path = os.path.normpath(path)
+        folder = self.get(path)
+        if folder is not None:
+            return folder
+
+        folder = Folder(path)
+        self.folders[self._key(path)] = folder
+        parent_path = os.path.dirname(path)
+        if parent_path != path and self._is_inside(parent_path) and self._key(path) != self._key(self.root):
+            parent = self._ensure_folder(parent_path)
+            if folder.name not in parent.subdirs:
+                parent.subdirs.append(folder.name)
+        return folder
+
+    def _unlink(self, path):
+        parent = self.get(os.path.dirname(os.path.normpath(path)))
+        name = os.path.basename(os.path.normpath(path))
+        if parent is not None and name in parent.subdirs:
+            parent.subdirs.remove(name)
+
+    def _subtree(self, folder):
+        """Yields folder and every folder beneath it that is in the inventory."""
+        stack = [folder]
+        while stack:
+            current = stack.pop()
+            yield current
+            for name in current.subdirs:
+                child = self.get(os.path.join(current.path, name))
+                if child is not None:
+                    stack.append(child)
+
+    def add_folder(self, path):
+        """Scans a newly created or changed folder into the inventory."""
+        if not self._is_inside(path):
+            return
+        existing = self.get(path)
+        if existing is not None:
+            for folder in list(self._subtree(existing)):
+                del self.folders[self._key(folder.path)]
+        self._scan(path)
+        parent_path = os.path.dirname(os.path.normpath(path))
+        if self._key(path) != self._key(self.root):
+            parent = self._ensure_folder(parent_path)
+            name = os.path.basename(os.path.normpath(path))
+            if name not in parent.subdirs:
+                parent.subdirs.append(name)
+
+    def remove_folder(self, path):
+        """Forgets a folder and everything beneath it."""
+        folder = self.get(path)
+        if folder is None:
+            return
+        for child in list(self._subtree(folder)):
+            self.folders.pop(self._key(child.path), None)
+        self._unlink(path)
+
+    def move_folder(self, old_path, new_path):
+        """
+        Records that old_path and everything beneath it now lives at new_path,
+        merging into new_path if it was already known.
+        """
+        folder = self.get(old_path)
+        if folder is None:
+            return
+        if not self._is_inside(new_path):
+            self.remove_folder(old_path)
+            return
+
+        old_root = folder.path
+        new_root = os.path.normpath(new_path)
+        moved = list(self._subtree(folder))
+        for child in moved:
+            self.folders.pop(self._key(child.path), None)
+        self._unlink(old_root)
+
+        for child in moved:
+            relative = os.path.relpath(child.path, old_root)
+            target_path = new_root if relative == os.curdir else os.path.join(new_root, relative)
+            if target_path not in self and relative != os.curdir:
+                # A renamed subfolder keeps its mtime and inode, so its cache entry stays valid
+                self.folders[self._key(target_path)] = Folder(
+                    target_path, readable=child.readable, mtime_ns=child.mtime_ns, inode=child.inode
+                )
+            target = self._ensure_folder(target_path)
+            target.files.update(child.files)
+            for name in child.subdirs:
+                if name not in target.subdirs:
+                    target.subdirs.append(name)
+            target.readable = target.readable and child.readable
+            target.refresh_encora_id()
+
+    def add_file(self, file_path, size=None, mtime_ns=None):
+        """Records a file that has been written, statting it unless its details are given."""
+        if not self._is_inside(file_path):
+            return
+        if size is None or mtime_ns is None:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                return
+            size, mtime_ns = stat.st_size, stat.st_mtime_ns
+
+        folder = self._ensure_folder(os.path.dirname(file_path))
+        folder.files[os.path.basename(file_path)] = (size, mtime_ns)
+        if folder.encora_id is None:
+            folder.refresh_encora_id()
+
+    def remove_file(self, file_path):
+        folder = self.get(os.path.dirname(file_path))
+        if folder is not None:
+            folder.files.pop(os.path.basename(file_path), None)
+
+    def rename_file(self, old_path, new_path):
+        folder = self.get(os.path.dirname(old_path))
+        details = folder.files.get(os.path.basename(old_path)) if folder else None
+        self.remove_file(old_path)
+        if details:
+            self.add_file(new_path, *details)
+        else:
+            self.add_file(new_path)
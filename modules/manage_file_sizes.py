@@ -1,11 +1,9 @@
 import os
 import time
-import requests
+import hashlib
 import urllib
-from modules.config import config
-from modules.api_utils import authenticated_request
-
-api_key = config.api_key
+from tqdm import tqdm
+from modules.parallel_walk import list_directory, scan_tree
 
 VIDEO_FORMATS = {
     '.avi', '.divx', '.m2t', '.m2ts', '.mp4', '.m4v', '.mpeg', '.mpg', '.mts', '.mov', 
@@ -14,6 +12,8 @@ VIDEO_FORMATS = {
 AUDIO_FORMATS = {
     '.mp3', '.m4a', '.wav', '.flac', '.aiff', '.m4b', '.alac', '.aac'
 }
+# Everything that can change a media summary (DVD smalls included)
+SUMMARY_FORMATS = VIDEO_FORMATS | AUDIO_FORMATS | {'.ifo', '.bup'}
 
 def get_file_size(size_bytes):
     """Convert file size in bytes to a human-readable format with binary units and trim off after the second decimal place."""
@@ -29,32 +29,77 @@ def get_file_size(size_bytes):
     else:
         return f"{size_bytes}B"  # No decimal places for bytes
 
-def evaluate_media_files(directory):
-    file_info = {'video': {}, 'audio': {}}
-    
-    for root, _, files in os.walk(directory):
-        for file in files:
-            file_ext = os.path.splitext(file)[1].lower()
-            file_path = os.path.join(root, file)
-            file_size_bytes = os.path.getsize(file_path)
-            
-            if file_ext in VIDEO_FORMATS:
-                if file_ext not in file_info['video']:
-                    file_info['video'][file_ext] = {'file_size': 0, 'count': 0}
-                file_info['video'][file_ext]['file_size'] += file_size_bytes
-                file_info['video'][file_ext]['count'] += 1
-            elif file_ext in AUDIO_FORMATS:
-                if file_ext not in file_info['audio']:
-                    file_info['audio'][file_ext] = {'file_size': 0, 'count': 0}
-                file_info['audio'][file_ext]['file_size'] += file_size_bytes
-                file_info['audio'][file_ext]['count'] += 1
+def iter_files_with_stats(directory, inventory=None, sized_extensions=None):
+    """
+    Yields (file_path, size_bytes, mtime_ns) for every file beneath directory.
+    Uses the inventory when it covers the folder, otherwise scans the folder
+    once with the parallel walker, reusing each DirEntry's stat result. When
+    sized_extensions is given, other files are yielded as (path, 0, None)
+    without being stat'ed at all.
+    """
+    if inventory is not None and directory in inventory:
+        yield from inventory.iter_files(directory)
+        return
+
+    def scan_directory(path, _):
+        subdirs, files, subdir_stats, _ = list_directory(path, sized_extensions)
+        children = [(os.path.join(path, name), stat) for name, stat in subdir_stats.items()]
+        return (subdirs, files), children
+
+    listings = dict(scan_tree(directory, scan_directory))
+
+    # Visit subfolders in the same order as os.walk so summaries stay stable
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        if current not in listings:
+            continue
+        subdirs, files = listings[current]
+        for name, (size, mtime_ns) in files.items():
+            yield os.path.join(current, name), size, mtime_ns
+        stack.extend(os.path.join(current, name) for name in reversed(subdirs))
+
+def collect_media_stats(directory, inventory=None):
+    """Gathers the video, audio and VOB stats for a recording in a single pass."""
+    media_stats = {
+        'video': {},
+        'audio': {},
+        'vob': {'total_size': 0, 'has_ifo': False, 'has_bup': False}
+    }
+
+    # Only video and audio sizes are reported, so DVD smalls never need a stat
+    sized_extensions = VIDEO_FORMATS | AUDIO_FORMATS
+    for file_path, file_size_bytes, _ in iter_files_with_stats(directory, inventory, sized_extensions):
+        file_ext = os.path.splitext(file_path)[1].lower()
+
+        if file_ext == '.vob':
+            media_stats['vob']['total_size'] += file_size_bytes
+        elif file_ext == '.ifo':
+            media_stats['vob']['has_ifo'] = True
+        elif file_ext == '.bup':
+            media_stats['vob']['has_bup'] = True
+
+        if file_ext in VIDEO_FORMATS:
+            category = 'video'
+        elif file_ext in AUDIO_FORMATS:
+            category = 'audio'
+        else:
+            continue
+
+        if file_ext not in media_stats[category]:
+            media_stats[category][file_ext] = {'file_size': 0, 'count': 0}
+        media_stats[category][file_ext]['file_size'] += file_size_bytes
+        media_stats[category][file_ext]['count'] += 1
+
+    return media_stats
 
+def aggregate_media_info(media_stats):
     # Aggregate file sizes and format information
     aggregated_info = []
     for category in ['video', 'audio']:
-        for file_type, info in file_info[category].items():
+        for file_type, info in media_stats[category].items():
             if file_type == '.vob':
-                continue  # Skip VOB files for now
+                continue  # VOBs are summarised separately
             
             size_str = get_file_size(info['file_size'])
             if info['count'] > 1:
@@ -71,39 +116,26 @@ def evaluate_media_files(directory):
 
     return aggregated_info
 
-def generate_vob_summary(directory):
-    vob_info = {'total_size': 0, 'with_smalls': False}
-    has_ifo = has_bup = False
-    
-    for root, _, files in os.walk(directory):
-        for file in files:
-            file_ext = os.path.splitext(file)[1].lower()
-            file_path = os.path.join(root, file)
-            file_size_bytes = os.path.getsize(file_path)
-            
-            if file_ext == '.vob':
-                vob_info['total_size'] += file_size_bytes
-            elif file_ext == '.ifo':
-                has_ifo = True
-            elif file_ext == '.bup':
-                has_bup = True
+def generate_vob_summary(media_stats):
+    vob_info = media_stats['vob']
     
     if vob_info['total_size'] > 0:
-        vob_info['with_smalls'] = has_ifo or has_bup
+        with_smalls = vob_info['has_ifo'] or vob_info['has_bup']
         vob_size_str = get_file_size(vob_info['total_size'])
-        vob_label = "VOB (with smalls)" if vob_info['with_smalls'] else "VOB (no smalls)"
+        vob_label = "VOB (with smalls)" if with_smalls else "VOB (no smalls)"
         return f"{vob_label} ({vob_size_str})"
     
     return None  # Return None if there are no VOB files
 
-def generate_media_summary(aggregated_info, vob_summary):
+def generate_media_summary(media_stats):
     summary = []
-    for info in aggregated_info:
+    for info in aggregate_media_info(media_stats):
         if 'count' in info:
             summary.append(f"{info['file_type']} x{info['count']} ({info['file_size']})")
         else:
             summary.append(f"{info['file_type']} ({info['file_size']})")
     
+    vob_summary = generate_vob_summary(media_stats)
     if vob_summary:
         summary.append(vob_summary)
     
@@ -111,43 +143,59 @@ def generate_media_summary(aggregated_info, vob_summary):
     media_summary = " | ".join(summary)
     return media_summary
 
-def process_directory(directory):
+def process_directory(directory, inventory=None):
     #directory = directory.replace('!processing\\', '')
-    media_info = evaluate_media_files(directory)
-    vob_summary = generate_vob_summary(directory)
-    summary = generate_media_summary(media_info, vob_summary)
-    return summary
+    media_stats = collect_media_stats(directory, inventory)
+    return generate_media_summary(media_stats)
 
-def send_format(recording_data, encora_id, media_summary):
-    """Send a POST request with the Encora ID and formatted media summary if necessary."""
+def media_signature(directory, inventory=None):
+    """Returns a hash of the relative path, size and mtime of every media file beneath directory."""
+    digest = hashlib.sha1()
+    media_files = [
+        (os.path.relpath(file_path, directory), size, mtime_ns)
+        for file_path, size, mtime_ns in iter_files_with_stats(directory, inventory)
+        if os.path.splitext(file_path)[1].lower() in SUMMARY_FORMATS
+    ]
+    for relative_path, size, mtime_ns in sorted(media_files):
+        digest.update(f"{relative_path}\0{size}\0{mtime_ns}\n".encode('utf-8', errors='surrogateescape'))
+    return digest.hexdigest()
 
-    headers = {
-        'Authorization': f'Bearer {api_key}', 
-        'Content-Type': 'application/json', 
-        "User-Agent": "BootOrganiser"
-    }
+def get_media_summary(encora_id, directory, inventory=None, cache=None):
+    """
+    Returns the media summary for a recording, only recomputing it when its
+    media files have changed since it was cached.
+    """
+    if cache is None:
+        return process_directory(directory, inventory)
 
-    # Find the matching recording from encora_data based on recording id
-    matching_recording = next((item for item in recording_data if item['encora_id'] == encora_id), None)
+    signature = media_signature(directory, inventory)
+    cached = cache.get_summary(encora_id)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    summary = process_directory(directory, inventory)
+    cache.put_summary(encora_id, signature, summary)
+    return summary
+
+def needs_format_update(collection, encora_id, media_summary):
+    """Returns True if the recording is in the collection and its Encora format differs from media_summary."""
+    # Find the local entry for this recording id
+    matching_recording = collection.local_entry(encora_id)
 
     if not matching_recording:
         print(f"Skipping format update for {encora_id}: Recording not found in your collection.")
-        return
+        return False
 
-    if matching_recording.get('my_format') == media_summary:
-        return
+    return matching_recording.get('my_format') != media_summary
 
-    # Update format if it doesn't match
-    url = f"https://encora.it/api/collection/{encora_id}/format/{urllib.parse.quote_plus(media_summary)}"
-    url = url.replace('+', '%20')
-    
-    try:
-        # Send empty json body to satisfy some server configurations
-        response = authenticated_request('POST', url, headers=headers, json={})
-        return True # Successfully sent update
-    except Exception as err:
-        if "500" in str(err):
-            print(f"Server Error (500) updating format for {encora_id}. The recording might not be in your collection or the ID is invalid.")
-        else:
-            print(f"Error updating format for {encora_id}: {err}")
-        return False
+def format_path(encora_id, media_summary):
+    """Returns the API path that sets a recording's format."""
+    url = f"collection/{encora_id}/format/{urllib.parse.quote_plus(media_summary)}"
+    return url.replace('+', '%20')
+
+def report_format_error(encora_id, err):
+    # Called from the format queue's workers while the file size bar is drawn, so write around it
+    if "500" in str(err):
+        tqdm.write(f"Server Error (500) updating format for {encora_id}. The recording might not be in your collection or the ID is invalid.")
+    else:
+        tqdm.write(f"Error updating format for {encora_id}: {err}")
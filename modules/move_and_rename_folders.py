@@ -1,9 +1,14 @@
+import errno
+import json
 import os
 import shutil
 import re
 from datetime import datetime
 from tqdm import tqdm
 from modules.config import config
+from modules.inventory import detect_encora_id
+from modules.move_engine import is_cross_device, move_folder_across_devices
+from modules.move_journal import MoveJournal, load_open_moves, rewrite_journal
 
 def sanitize_path(path):
     return re.sub(r'[<>:"/\\|?*]', '_', path)
@@ -24,6 +29,7 @@ def remove_sorting_articles(name):
 
 def move_folders_to_processing(main_directory):
     # This function is no longer used but kept for backward compatibility if needed.
+    # Interrupted moves are now recovered from the move journal instead (see recover_interrupted_moves).
     pass
 
 def format_date(date_info):
@@ -127,63 +133,335 @@ def format_show_folder(recording_data, encora_id, format_string, folder_name=Non
 
     return formatted_name
 
-def move_and_rename_folders(encora_data, main_directory):
+# Problems that stop a planned move from being applied
+CONFLICT_DUPLICATE_TARGET = 'duplicate_target'  # Another recording maps to the same folder
+CONFLICT_CASE = 'case_collision'  # A folder differing only by case already exists
+CONFLICT_TARGET_IS_RECORDING = 'target_is_recording'  # Another recording already lives there
+CONFLICT_INSIDE_SOURCE = 'target_inside_source'
+CONFLICT_MISSING_SOURCE = 'missing_source'
+
+def target_path(recording_data, encora_id, main_directory):
+    """Returns the folder a recording belongs in under the configured patterns."""
     show_directory_format = config.show_directory_format or '{show_name}/{tour}/{type}/{folder}'
     show_folder_format = config.show_folder_format or '[{date}] [{matinee}] [{nft}] {show_name} ~ {master} {encora_id}'
 
+    show_folder = format_show_folder(recording_data, encora_id, show_folder_format)
+    show_directory = format_show_folder(recording_data, encora_id, show_directory_format, folder_name=show_folder)
+
+    if '{folder}' in show_directory_format:
+        return os.path.join(main_directory, show_directory)
+    return os.path.join(main_directory, show_directory, show_folder)
+
+def path_key(path):
+    """Case-insensitive key for a path, so plans are safe on any file system."""
+    return os.path.normpath(path).lower()
+
+def is_inside(path, directory):
+    path, directory = path_key(path), path_key(directory)
+    return path != directory and path.startswith(directory.rstrip(os.sep) + os.sep)
+
+def list_subdirs(directory, inventory, listings):
+    """Folder names in directory, from the inventory where it has them, cached in listings."""
+    if directory not in listings:
+        folder = inventory.get(directory) if inventory is not None else None
+        if folder is not None:
+            listings[directory] = list(folder.subdirs)
+        else:
+            try:
+                listings[directory] = [entry.name for entry in os.scandir(directory) if entry.is_dir()]
+            except OSError:
+                listings[directory] = []
+    return listings[directory]
+
+def reserve_path(path, main_directory, inventory, listings):
+    """Records a folder an earlier planned move will create, so later moves are checked against it."""
+    current = os.path.normpath(main_directory)
+    for name in os.path.relpath(os.path.normpath(path), current).split(os.sep):
+        names = list_subdirs(current, inventory, listings)
+        if name not in names:
+            names.append(name)
+        current = os.path.join(current, name)
+
+def find_case_collision(path, main_directory, inventory=None, listings=None):
+    """
+    Returns an existing (or already planned) folder whose path matches path
+    apart from letter case in any component below main_directory, or None.
+    """
+    listings = {} if listings is None else listings
+    current = os.path.normpath(main_directory)
+    for name in os.path.relpath(os.path.normpath(path), current).split(os.sep):
+        names = list_subdirs(current, inventory, listings)
+        if name not in names:
+            twin = next((existing for existing in names if existing.lower() == name.lower()), None)
+            if twin is not None:
+                return os.path.join(current, twin)
+            return None  # Nothing exists from here down
+        current = os.path.join(current, name)
+    return None
+
+def plan_moves(collection, main_directory, inventory=None):
+    """
+    Works out where every local recording should move to, before anything is
+    touched. Returns a plan dict whose 'moves' list holds one entry per folder
+    that needs to move:
+
+        {'encora_id', 'old_path', 'new_path', 'method', 'conflict'}
+
+    method is 'rename' (one atomic rename of the whole folder, used whenever
+    the target doesn't exist and is on the same device), 'move' (the target
+    doesn't exist but is on another device, so the folder is copied across
+    and verified before the source is deleted) or 'merge' (the target folder
+    already exists, so the contents are moved into it). Moves with a conflict
+    are reported and left alone when the plan is applied.
+    """
+    moves = []
+    by_target = {}
+    local_paths = {path_key(entry['path']) for entry in collection.local}
+    listings = {}
+
     # Sort by path length descending so children are processed before parents
-    encora_data_sorted = sorted(encora_data, key=lambda x: len(x['path']), reverse=True)
-    
-    for entry in tqdm(encora_data_sorted, desc="Moving and Renaming Folders"):
+    for entry in sorted(collection.local, key=lambda x: len(x['path']), reverse=True):
         old_path = entry['path']
-        recording_data = entry['recording_data']
-        encora_id = entry['encora_id']
-        
-        show_folder = format_show_folder(recording_data, encora_id, show_folder_format)
-        show_directory = format_show_folder(recording_data, encora_id, show_directory_format, folder_name=show_folder)
-        
-        if '{folder}' in show_directory_format:
-            new_path = os.path.join(main_directory, show_directory)
-        else:
-            new_path = os.path.join(main_directory, show_directory, show_folder)
-        
+        new_path = target_path(entry['recording_data'], entry['encora_id'], main_directory)
+        move = {
+            'encora_id': entry['encora_id'],
+            'old_path': old_path,
+            'new_path': new_path,
+            'method': None,
+            'conflict': None
+        }
+        by_target.setdefault(path_key(new_path), []).append(move)
+
         # If old_path and new_path are the same, nothing to do
         if os.path.normpath(old_path) == os.path.normpath(new_path):
+            move['method'] = 'none'
             continue
+        moves.append(move)
+
+        if not os.path.exists(old_path):
+            move['conflict'] = CONFLICT_MISSING_SOURCE
+        elif is_inside(new_path, old_path):
+            move['conflict'] = CONFLICT_INSIDE_SOURCE
+        elif path_key(old_path) == path_key(new_path):
+            move['method'] = 'rename'  # Only the letter case changes
+        elif path_key(new_path) in local_paths:
+            move['conflict'] = CONFLICT_TARGET_IS_RECORDING
+        else:
+            twin = find_case_collision(new_path, main_directory, inventory, listings)
+            if twin is not None:
+                move['conflict'] = f"{CONFLICT_CASE}: {twin}"
+            elif os.path.exists(new_path):
+                move['method'] = 'merge'
+            else:
+                move['method'] = 'move' if is_cross_device(old_path, new_path) else 'rename'
+                reserve_path(new_path, main_directory, inventory, listings)
+
+    # Recordings that would end up in the same folder are all left where they are
+    for planned in by_target.values():
+        if len(planned) > 1:
+            for move in planned:
+                if move['method'] != 'none':
+                    move['conflict'] = move['conflict'] or CONFLICT_DUPLICATE_TARGET
+
+    return {
+        'main_directory': main_directory,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'moves': moves
+    }
+
+def save_move_plan(plan, plan_path):
+    tmp_path = f"{plan_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(plan, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, plan_path)
 
-        # Ensure all directories in the new path exist
+def load_move_plan(plan_path):
+    with open(plan_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def report_move_conflicts(plan):
+    conflicts = [move for move in plan['moves'] if move['conflict']]
+    for move in conflicts:
+        print(f"Not moving e-{move['encora_id']} ({move['conflict']}): '{move['old_path']}' -> '{move['new_path']}'")
+    return conflicts
+
+def merge_folder(old_path, new_path):
+    """Moves the contents of old_path into the existing new_path and removes old_path if it ends up empty."""
+    for item in os.listdir(old_path):
+        src = os.path.join(old_path, item)
+        dst = os.path.join(new_path, item)
         try:
-            if not os.path.exists(new_path):
-                os.makedirs(new_path)
-        except Exception as e:
-            print(f"Error creating directories: {e}")
-            continue
+            # Overwrite existing file if it exists
+            shutil.move(src, dst)
+        except FileNotFoundError as e:
+            print(f"FileNotFoundError: {e}")
 
-        if os.path.exists(old_path):
-            for item in os.listdir(old_path):
-                src = os.path.join(old_path, item)
-                dst = os.path.join(new_path, item)
-
-                if os.path.isdir(src):
-                    try:
-                        shutil.move(src, dst)
-                    except FileNotFoundError as e:
-                        print(f"FileNotFoundError: {e}")
-                else:
-                    try:
-                        # Overwrite existing file if it exists
-                        shutil.move(src, dst)
-                    except FileNotFoundError as e:
-                        print(f"FileNotFoundError: {e}")
-            
-            try:
-                if not os.listdir(old_path):  # Ensure the directory is empty before removal
-                    os.rmdir(old_path)
-                else:
-                    print(f"Directory '{old_path}' is not empty.")
-            except FileNotFoundError as e:
-                print(f"FileNotFoundError: {e}")
-            except OSError as e:
-                print(f"OSError: {e}")
+    if os.listdir(old_path):  # Ensure the directory is empty before removal
+        print(f"Directory '{old_path}' is not empty.")
+        return False
+    os.rmdir(old_path)
+    return True
+
+def folder_recording_id(path, collection=None):
+    """Returns the Encora ID of the recording in an existing folder, or None if it isn't one."""
+    entry = collection.local_at(path) if collection is not None else None
+    if entry is not None:
+        return str(entry['encora_id'])
+    try:
+        id_files = [entry.name for entry in os.scandir(path) if entry.name.startswith('.encora-')]
+    except OSError:
+        return None
+    return detect_encora_id(os.path.basename(os.path.normpath(path)), id_files)
+
+def recheck_move(move, main_directory, collection=None, inventory=None):
+    """
+    Re-runs the plan's target checks against the library as it is now, since
+    it may have changed since the plan was made. Returns a conflict or None.
+    """
+    old_path, new_path = move['old_path'], move['new_path']
+    if path_key(old_path) == path_key(new_path):
+        return None  # Only the letter case changes
+    twin = find_case_collision(new_path, main_directory, inventory)
+    if twin is not None:
+        return f"{CONFLICT_CASE}: {twin}"
+    if os.path.isdir(new_path) and folder_recording_id(new_path, collection) is not None:
+        return CONFLICT_TARGET_IS_RECORDING
+    return None
+
+def apply_move(move, journal=None, main_directory=None, collection=None, inventory=None):
+    """
+    Carries out one planned move, journalling it first when a journal is
+    given. When main_directory is given the target is checked again first,
+    and a move that now conflicts is reported and skipped. Returns True if
+    the folder now lives at new_path.
+    """
+    old_path, new_path, method = move['old_path'], move['new_path'], move['method']
+    if not os.path.exists(old_path):
+        print(f"Source path '{old_path}' does not exist.")
+        return False
+
+    # The disk may have changed since the plan was made
+    if main_directory is not None:
+        conflict = recheck_move(move, main_directory, collection, inventory)
+        if conflict is not None:
+            move['conflict'] = conflict
+            print(f"Not moving e-{move['encora_id']} ({conflict}): '{old_path}' -> '{new_path}'")
+            return False
+    if method != 'merge' and os.path.exists(new_path) and path_key(old_path) != path_key(new_path):
+        method = 'merge'
+
+    move_id = journal.begin(old_path, new_path, method) if journal is not None else None
+    on_copied = (lambda: journal.mark(move_id, 'copied')) if journal is not None else None
+    moved = False
+    try:
+        if method == 'merge' and not is_cross_device(old_path, new_path):
+            moved = merge_folder(old_path, new_path)
         else:
-            print(f"Source path '{old_path}' does not exist.")
+            os.makedirs(os.path.dirname(os.path.normpath(new_path)), exist_ok=True)
+            if method == 'rename':
+                try:
+                    os.rename(old_path, new_path)
+                    moved = True
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        raise
+                    if journal is not None:
+                        journal.begin(old_path, new_path, 'move', move_id)
+            if not moved:
+                move_folder_across_devices(old_path, new_path, on_copied=on_copied)
+                moved = True
+    except FileNotFoundError as e:
+        print(f"FileNotFoundError: {e}")
+    except OSError as e:
+        print(f"OSError: {e}")
+
+    if journal is not None:
+        journal.mark(move_id, 'done' if moved else 'failed')
+    return moved
+
+def recover_move(move):
+    """
+    Finishes or undoes one move left open in the journal, looking only at its
+    two paths. Returns 'completed' or 'rolled back'.
+    """
+    old_path, new_path, method = move['old_path'], move['new_path'], move['method']
+    old_exists, new_exists = os.path.exists(old_path), os.path.exists(new_path)
+
+    if method == 'rename' or not old_exists:
+        # A rename either happened or it didn't; a move only deletes its source once copied
+        return 'completed' if new_exists and not old_exists else 'rolled back'
+
+    if method == 'move':
+        if move['copied']:
+            # Every file reached new_path and was verified; finish deleting the source
+            shutil.rmtree(old_path)
+            return 'completed'
+        if new_exists:
+            # The target didn't exist before this move, so it only holds a partial copy
+            shutil.rmtree(new_path)
+        return 'rolled back'
+
+    # A merge moves items one at a time into an existing folder, so carry on with the rest
+    if not apply_move({'old_path': old_path, 'new_path': new_path, 'method': 'merge'}):
+        raise OSError(f"Could not finish merging '{old_path}' into '{new_path}'")
+    return 'completed'
+
+def recover_interrupted_moves(journal_path=None):
+    """
+    Replays or rolls back the moves an interrupted run left open in the move
+    journal. Moves that can't be recovered are kept in the journal for the
+    next run, and the journal is removed once nothing is left in it. Only the
+    journalled paths are looked at, so this takes time in proportion to the
+    journal, not the library.
+    """
+    journal_path = journal_path or config.move_journal_path
+    if not os.path.exists(journal_path):
+        return
+
+    open_moves = load_open_moves(journal_path)
+    if open_moves:
+        print(f"Recovering {len(open_moves)} folder moves interrupted in the last run...")
+    unrecovered = []
+    for move in open_moves:
+        try:
+            result = recover_move(move)
+            print(f"  {result}: '{move['old_path']}' -> '{move['new_path']}'")
+        except OSError as e:
+            unrecovered.append(move)
+            print(f"Warning: Could not recover the move '{move['old_path']}' -> '{move['new_path']}', please check both folders: {e}")
+
+    try:
+        rewrite_journal(unrecovered, journal_path)
+    except OSError as e:
+        print(f"Warning: Could not update the move journal: {e}")
+
+def apply_move_plan(plan, collection=None, inventory=None, journal_path=None):
+    """
+    Applies the moves in a plan that have no conflict, keeping the collection
+    and inventory (when given) in step. Every move goes through the move
+    journal. Returns the number of folders moved.
+    """
+    recover_interrupted_moves(journal_path)
+    pending = [move for move in plan['moves'] if not move['conflict'] and move['method'] != 'none']
+    if not pending:
+        return 0
+
+    journal = MoveJournal(journal_path).open()
+    moved = 0
+    try:
+        for move in tqdm(pending, desc="Moving and Renaming Folders"):
+            if not apply_move(move, journal, plan['main_directory'], collection, inventory):
+                continue
+            moved += 1
+            if collection is not None:
+                collection.move_local(move['old_path'], move['new_path'])
+            if inventory is not None:
+                inventory.move_folder(move['old_path'], move['new_path'])
+    finally:
+        journal.close()
+    return moved
+
+def move_and_rename_folders(collection, main_directory, inventory=None):
+    plan = plan_moves(collection, main_directory, inventory)
+    report_move_conflicts(plan)
+    return apply_move_plan(plan, collection, inventory)
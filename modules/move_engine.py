@@ -0,0 +1,178 @@
+import hashlib
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+from modules.config import config
+
+# Read/write size for the buffered fallback copy, and the most each
+# copy_file_range/sendfile call is asked to move at once
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+class MoveVerificationError(OSError):
+    """A copied file didn't match its source, so the source was kept."""
+
+def is_cross_device(old_path, new_path):
+    """True if new_path (or the nearest folder above it that exists) is on a different device to old_path."""
+    parent = os.path.dirname(os.path.normpath(new_path))
+    while parent and not os.path.exists(parent):
+        next_parent = os.path.dirname(parent)
+        if next_parent == parent:
+            break
+        parent = next_parent
+    try:
+        return os.stat(old_path).st_dev != os.stat(parent).st_dev
+    except OSError:
+        return True
+
+def _copy_in_kernel(copy, src_fd, dst_fd, size, progress):
+    """
+    Copies with copy(src_fd, dst_fd, offset, count), i.e. copy_file_range or
+    sendfile. Returns False if the call isn't supported for these files.
+    """
+    copied = 0
+    while copied < size:
+        try:
+            sent = copy(src_fd, dst_fd, copied, min(COPY_CHUNK_SIZE, size - copied))
+        except OSError:
+            if copied:
+                raise
+            return False
+        if sent == 0:
+            if not copied:
+                return False
+            break
+        copied += sent
+        progress(sent)
+    return True
+
+def copy_file(src, dst, progress):
+    """
+    Copies one file, calling progress(bytes) as data is written. Uses
+    copy_file_range, then sendfile, where the platform offers them, and a
+    large buffered copy otherwise. Permissions and times are copied too.
+    """
+    size = os.path.getsize(src)
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+        copied = False
+        if hasattr(os, 'copy_file_range'):
+            copied = _copy_in_kernel(lambda i, o, offset, n: os.copy_file_range(i, o, n, offset), src_fd, dst_fd, size, progress)
+        if not copied and hasattr(os, 'sendfile'):
+            copied = _copy_in_kernel(lambda i, o, offset, n: os.sendfile(o, i, offset, n), src_fd, dst_fd, size, progress)
+        if not copied:
+            while True:
+                chunk = fsrc.read(COPY_BUFFER_SIZE)
+                if not chunk:
+                    break
+                fdst.write(chunk)
+                progress(len(chunk))
+    shutil.copystat(src, dst)
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_BUFFER_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def copy_link(src, dst):
+    """Recreates the symlink src at dst, pointing at the same target, replacing anything already at dst."""
+    target = os.readlink(src)
+    if os.path.lexists(dst):
+        if os.path.isdir(dst) and not os.path.islink(dst):
+            shutil.rmtree(dst)
+        else:
+            os.remove(dst)
+    os.symlink(target, dst, target_is_directory=os.path.isdir(src))
+    if os.readlink(dst) != target:
+        raise MoveVerificationError(f"Link target mismatch copying '{src}' to '{dst}'")
+
+def verify_copy(src, dst, verify):
+    """Raises MoveVerificationError if dst doesn't match src by size (and checksum, if asked)."""
+    if os.path.getsize(src) != os.path.getsize(dst):
+        raise MoveVerificationError(f"Size mismatch copying '{src}' to '{dst}'")
+    if verify == 'checksum' and file_checksum(src) != file_checksum(dst):
+        raise MoveVerificationError(f"Checksum mismatch copying '{src}' to '{dst}'")
+
+def list_tree(root):
+    """
+    Returns the folders, (path, size) files and symlinks beneath root, relative
+    to it. Symlinks are never followed, and anything that isn't a folder, file
+    or symlink raises shutil.SpecialFileError before anything is copied.
+    """
+    folders, files, links = [], [], []
+    pending = [os.curdir]
+    while pending:
+        relative = pending.pop()
+        with os.scandir(os.path.join(root, relative)) as entries:
+            for entry in entries:
+                path = os.path.normpath(os.path.join(relative, entry.name))
+                if entry.is_symlink():
+                    links.append(path)
+                elif entry.is_dir(follow_symlinks=False):
+                    folders.append(path)
+                    pending.append(path)
+                elif entry.is_file(follow_symlinks=False):
+                    files.append((path, entry.stat(follow_symlinks=False).st_size))
+                else:
+                    raise shutil.SpecialFileError(f"'{entry.path}' is not a regular file, folder or symlink")
+    return folders, files, links
+
+def copy_folder(old_path, new_path, workers=None, verify=None):
+    """
+    Copies old_path into new_path (which may already exist; files in it are
+    overwritten), copying several files at once, largest first, with a
+    byte-level progress bar. Every file is verified once it is written.
+    Symlinks are copied as symlinks to the same target. Returns the relative
+    paths of the files and symlinks that were copied.
+    """
+    workers = max(1, workers or config.move_workers)
+    verify = verify or config.move_verify
+    folders, files, links = list_tree(old_path)
+
+    os.makedirs(new_path, exist_ok=True)
+    for folder in folders:
+        os.makedirs(os.path.join(new_path, folder), exist_ok=True)
+    for link in links:
+        copy_link(os.path.join(old_path, link), os.path.join(new_path, link))
+
+    lock = threading.Lock()
+    total = sum(size for _, size in files)
+    with tqdm(total=total, desc=f"Copying {os.path.basename(os.path.normpath(old_path))}",
+              unit='B', unit_scale=True, unit_divisor=1024, leave=False) as bar:
+        def progress(count):
+            with lock:
+                bar.update(count)
+
+        def copy_one(relative):
+            src, dst = os.path.join(old_path, relative), os.path.join(new_path, relative)
+            copy_file(src, dst, progress)
+            verify_copy(src, dst, verify)
+
+        # Largest first, so one big VOB doesn't start last and hold up the folder
+        ordered = [relative for relative, _ in sorted(files, key=lambda item: item[1], reverse=True)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for _ in executor.map(copy_one, ordered):
+                pass
+    return [relative for relative, _ in files] + links
+
+def move_folder_across_devices(old_path, new_path, workers=None, verify=None, on_copied=None):
+    """
+    Moves a folder to another device: copies and verifies everything first,
+    and only then deletes the source. If anything fails, the source is left
+    untouched and a folder created by the copy is removed again. on_copied is
+    called between the verified copy and deleting the source.
+    """
+    created = not os.path.exists(new_path)
+    try:
+        copy_folder(old_path, new_path, workers, verify)
+    except BaseException:
+        if created:
+            shutil.rmtree(new_path, ignore_errors=True)
+        raise
+    if on_copied is not None:
+        on_copied()
+    shutil.rmtree(old_path)
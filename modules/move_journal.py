@@ -0,0 +1,135 @@
+import json
+import os
+import threading
+from modules.config import config
+
+class MoveJournal:
+    """
+    Write-ahead journal of folder moves, kept as JSONL next to .env.
+
+    Each move is journalled as 'planned' (with its paths and method) and
+    synced to disk before anything on disk is touched. It is then marked
+    'copied' (cross-device moves, once every file is copied and verified),
+    'done' or 'failed'. If a run is killed partway through a move, the next
+    run finds the move still open in the journal and finishes or undoes it
+    by looking at just those two paths, without rescanning the library.
+    """
+
+    def __init__(self, journal_path=None):
+        self.journal_path = journal_path or config.move_journal_path
+        self._lock = threading.Lock()
+        self._file = None
+        self._next_id = 0
+        self._open = set()  # IDs of moves that are planned but not yet done or failed
+
+    def open(self):
+        """
+        Opens the journal for appending. Moves a previous run couldn't recover
+        stay open, and new IDs carry on after the largest already journalled.
+        """
+        open_moves, last_id = read_journal(self.journal_path)
+        with self._lock:
+            self._open.update(open_moves)
+            self._next_id = last_id + 1
+        self._file = open(self.journal_path, 'a', encoding='utf-8')
+        return self
+
+    def _write(self, entry, sync=False):
+        with self._lock:
+            self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            self._file.flush()
+            if sync:
+                os.fsync(self._file.fileno())
+
+    def begin(self, old_path, new_path, method, move_id=None):
+        """Journals a move about to start (or a change to its method) and returns its ID."""
+        if move_id is None:
+            with self._lock:
+                move_id = self._next_id
+                self._next_id += 1
+                self._open.add(move_id)
+        self._write({'op': 'planned', 'id': move_id, 'old_path': old_path, 'new_path': new_path, 'method': method}, sync=True)
+        return move_id
+
+    def mark(self, move_id, op):
+        """Records a move reaching 'copied', 'done' or 'failed'."""
+        self._write({'op': op, 'id': move_id}, sync=op == 'copied')
+        if op in ('done', 'failed'):
+            with self._lock:
+                self._open.discard(move_id)
+
+    def close(self):
+        """Closes the journal, deleting it if every move in it finished."""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        if not self._open:
+            try:
+                os.remove(self.journal_path)
+            except OSError:
+                pass
+
+def read_journal(journal_path):
+    """
+    Returns ({move_id: move} for the moves the journal has no 'done' or
+    'failed' entry for, in the order they were started, and the largest move
+    ID in the journal, or -1 if there is none).
+    """
+    moves = {}
+    last_id = -1
+    try:
+        with open(journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    op, move_id = entry['op'], entry['id']
+                except (ValueError, KeyError, TypeError):
+                    continue  # A line cut short by a crash
+                if isinstance(move_id, int):
+                    last_id = max(last_id, move_id)
+                if op == 'planned':
+                    copied = moves.get(move_id, {}).get('copied', False)
+                    moves[move_id] = {
+                        'id': move_id,
+                        'old_path': entry['old_path'],
+                        'new_path': entry['new_path'],
+                        'method': entry['method'],
+                        'copied': copied
+                    }
+                elif op == 'copied' and move_id in moves:
+                    moves[move_id]['copied'] = True
+                elif op in ('done', 'failed'):
+                    moves.pop(move_id, None)
+    except OSError:
+        pass
+    return moves, last_id
+
+def load_open_moves(journal_path=None):
+    """
+    Returns the moves the journal has no 'done' or 'failed' entry for, in the
+    order they were started, each as {'id', 'old_path', 'new_path', 'method', 'copied'}.
+    """
+    moves, _ = read_journal(journal_path or config.move_journal_path)
+    return list(moves.values())
+
+def rewrite_journal(moves, journal_path=None):
+    """
+    Replaces the journal with just the given open moves, keeping their IDs,
+    or removes it if there are none left.
+    """
+    journal_path = journal_path or config.move_journal_path
+    if not moves:
+        if os.path.exists(journal_path):
+            os.remove(journal_path)
+        return
+    tmp_path = f"{journal_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for move in moves:
+            entry = {'op': 'planned', 'id': move['id'], 'old_path': move['old_path'], 'new_path': move['new_path'], 'method': move['method']}
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            if move['copied']:
+                f.write(json.dumps({'op': 'copied', 'id': move['id']}) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, journal_path)
@@ -1,30 +1,53 @@
 import os
 import shutil
+from modules.inventory import LibraryInventory
 
-def folder_exists_in_non_encora(folder_name, base_path):
-    for root, dirs, _ in os.walk(base_path):
-        if folder_name in dirs:
-            return True
-    return False
+def index_non_encora_names(non_encora_folder, inventory):
+    """Returns the names of every folder anywhere inside '!non-encora'."""
+    names = set()
+    for _, dirs, _ in inventory.walk(non_encora_folder):
+        names.update(dirs)
+    return names
+
+def move_folders_with_ne(main_directory, non_encora_folder, inventory=None):
+    """
+    Moves every '{ne}' folder into '!non-encora', unless a folder with the
+    same name is already archived there. '!non-encora' is indexed once up
+    front, and the walk never descends into it or into Encora recordings.
+    """
+    if inventory is None:
+        inventory = LibraryInventory(main_directory).build()
 
-def move_folders_with_ne(main_directory, non_encora_folder):
     # Create the '!non-encora' folder if it doesn't exist
     if not os.path.exists(non_encora_folder):
         os.makedirs(non_encora_folder)
         print(f"Created folder: {non_encora_folder}")
+        inventory.add_folder(non_encora_folder)
+
+    archived_names = index_non_encora_names(non_encora_folder, inventory)
+    non_encora_key = os.path.normcase(os.path.normpath(non_encora_folder))
 
     # Loop through all subfolders in main_directory
-    for root, dirs, _ in os.walk(main_directory):
-        for dir_name in dirs:
-            if '{ne}' in dir_name:
-                # Paths
-                folder_path = os.path.join(root, dir_name)
+    for root, dirs, _ in inventory.walk(main_directory):
+        for dir_name in list(dirs):
+            folder_path = os.path.join(root, dir_name)
+            if os.path.normcase(os.path.normpath(folder_path)) == non_encora_key:
+                dirs.remove(dir_name)
+                continue
+
+            folder = inventory.get(folder_path)
+            if folder is not None and folder.encora_id:
+                # An Encora recording never holds non-Encora recordings
+                dirs.remove(dir_name)
+                continue
+
+            # Check if the folder already exists anywhere in '!non-encora'
+            if '{ne}' in dir_name and dir_name not in archived_names:
+                # Move the folder to '!non-encora'
                 dest_path = os.path.join(non_encora_folder, dir_name)
-                
-                # Check if the folder already exists anywhere in '!non-encora'
-                if not folder_exists_in_non_encora(dir_name, non_encora_folder):
-                    # Move the folder to '!non-encora'
-                    shutil.move(folder_path, dest_path)
-                    print(f"Moved Non-Encora recording from {folder_path} to {dest_path}")
-                else:
-                    continue
+                shutil.move(folder_path, dest_path)
+                print(f"Moved Non-Encora recording from {folder_path} to {dest_path}")
+                inventory.move_folder(folder_path, dest_path)
+                archived_names.add(dir_name)
+                archived_names.update(name for _, subdirs, _ in inventory.walk(dest_path) for name in subdirs)
+                dirs.remove(dir_name)
@@ -0,0 +1,98 @@
+import os
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from modules.config import config
+
+def list_directory(path, sized_extensions=None):
+    """
+    Lists one directory with os.scandir.
+    Returns (subdirs, files, subdir_stats, readable) where files maps each file
+    name to (size, mtime_ns). Files whose extension is not in sized_extensions
+    (when given) are recorded as (0, None) without being stat'ed.
+
+    Entries are sorted the way os.walk does: symlinks to directories are listed
+    in subdirs but have no entry in subdir_stats, so they are never followed,
+    and broken symlinks and other special files are listed in files.
+    Only the directories in subdir_stats should be scanned further.
+    """
+    subdirs, files, subdir_stats = [], {}, {}
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdir_stats[entry.name] = entry.stat(follow_symlinks=False)
+                        subdirs.append(entry.name)
+                        continue
+                    if entry.is_dir():
+                        subdirs.append(entry.name)
+                        continue
+                except OSError:
+                    pass
+
+                if sized_extensions is not None and os.path.splitext(entry.name)[1].lower() not in sized_extensions:
+                    files[entry.name] = (0, None)
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    try:
+                        stat = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        files[entry.name] = (0, None)
+                        continue
+                files[entry.name] = (stat.st_size, stat.st_mtime_ns)
+    except OSError:
+        return [], {}, {}, False
+    return subdirs, files, subdir_stats, True
+
+def scan_tree(top, scan_directory, workers=None, per_device=None):
+    """
+    Runs scan_directory(path, stat) over every directory under top on a thread
+    pool and yields (path, result) as each directory finishes.
+
+    scan_directory returns (result, children) where children is a list of
+    (path, stat) pairs to scan next; stat may be None if it isn't known yet.
+    Directories are queued per device (st_dev) and no device ever has more
+    than per_device scans in flight, so one slow disk or network mount can't
+    be thrashed while the others sit idle. Children without a stat are
+    stat'ed here, so a mount point is always queued on its own device.
+    """
+    workers = max(1, workers or config.scan_workers)
+    per_device = max(1, per_device or config.scan_workers_per_device)
+
+    try:
+        top_stat = os.stat(top)
+    except OSError:
+        top_stat = None
+
+    pending = defaultdict(deque)  # device -> deque of (path, stat)
+    in_flight = Counter()
+    futures = {}
+    pending[top_stat.st_dev if top_stat else None].append((top, top_stat))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        def schedule():
+            for device, queue in pending.items():
+                while queue and in_flight[device] < per_device and len(futures) < workers:
+                    path, stat = queue.popleft()
+                    futures[pool.submit(scan_directory, path, stat)] = (path, device)
+                    in_flight[device] += 1
+
+        schedule()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, device = futures.pop(future)
+                in_flight[device] -= 1
+                result, children = future.result()
+                for child_path, child_stat in children:
+                    if child_stat is None:
+                        try:
+                            child_stat = os.stat(child_path, follow_symlinks=False)
+                        except OSError:
+                            pass
+                    child_device = child_stat.st_dev if child_stat else device
+                    pending[child_device].append((child_path, child_stat))
+                yield path, result
+            schedule()
@@ -0,0 +1,64 @@
+import json
+import sqlite3
+
+class ScanCache:
+    """
+    SQLite record of every directory the inventory has scanned, keyed on the
+    directory's mtime and inode. A directory whose mtime and inode still match
+    can reuse its cached listing instead of being scanned again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS directories ("
+            "key TEXT PRIMARY KEY, mtime_ns INTEGER, inode INTEGER, encora_id TEXT, "
+            "subdirs TEXT, files TEXT)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS media_summaries ("
+            "encora_id TEXT PRIMARY KEY, signature TEXT, summary TEXT)"
+        )
+        self.connection.commit()
+
+    def load_directories(self):
+        """Returns {key: (mtime_ns, inode, subdirs, files)} for every cached directory."""
+        directories = {}
+        rows = self.connection.execute("SELECT key, mtime_ns, inode, subdirs, files FROM directories")
+        for key, mtime_ns, inode, subdirs, files in rows:
+            try:
+                files = {name: tuple(details) for name, details in json.loads(files).items()}
+                directories[key] = (mtime_ns, inode, json.loads(subdirs), files)
+            except (TypeError, ValueError):
+                continue
+        return directories
+
+    def save_directories(self, rows):
+        """Replaces the cache with rows of (key, mtime_ns, inode, encora_id, subdirs, files)."""
+        with self.connection:
+            self.connection.execute("DELETE FROM directories")
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?, ?, ?)",
+                ((key, mtime_ns, inode, encora_id, json.dumps(subdirs), json.dumps(files))
+                 for key, mtime_ns, inode, encora_id, subdirs, files in rows)
+            )
+
+    def get_summary(self, encora_id):
+        """Returns (signature, summary) for a recording, or None."""
+        return self.connection.execute(
+            "SELECT signature, summary FROM media_summaries WHERE encora_id = ?",
+            (str(encora_id),)
+        ).fetchone()
+
+    def put_summary(self, encora_id, signature, summary):
+        """Stores a freshly computed summary."""
+        self.connection.execute(
+            "INSERT INTO media_summaries (encora_id, signature, summary) VALUES (?, ?, ?) "
+            "ON CONFLICT(encora_id) DO UPDATE SET signature = excluded.signature, summary = excluded.summary",
+            (str(encora_id), signature, summary)
+        )
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+from modules.config import config
+
+def load_subtitle_manifest():
+    """
+    Returns the subtitle manifest: {recording_id: {subtitle_uid: entry}}, where
+    each entry records the url, updated_at, file_name, size, sha256 and HTTP
+    validators of the subtitle as it was last downloaded.
+    """
+    try:
+        with open(config.subtitle_manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+def save_subtitle_manifest(manifest):
+    """Writes the subtitle manifest for the next run."""
+    path = config.subtitle_manifest_path
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Warning: Could not save subtitle manifest: {e}")
+
+def describes(entry, subtitle, file_name):
+    """True if a manifest entry is for the subtitle Encora lists, under the same file name."""
+    return (
+        entry is not None
+        and entry.get('url') == subtitle.get('url')
+        and entry.get('file_name') == file_name
+    )
+
+def is_unchanged(entry, subtitle, file_name):
+    """
+    True if Encora's updated_at shows the subtitle hasn't changed since the
+    entry was recorded. Without an updated_at on both sides the listing can't
+    tell, so the file has to be revalidated or downloaded again.
+    """
+    return (
+        describes(entry, subtitle, file_name)
+        and entry.get('updated_at') is not None
+        and entry.get('updated_at') == subtitle.get('updated_at')
+    )
+
+def revalidation_headers(entry):
+    """Conditional request headers from the validators the server sent with the last download, if any."""
+    headers = {}
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+def matches_local_file(entry, file_path, size, check_hash=False):
+    """
+    True if the file on disk (size bytes, or None if missing) is the one the
+    entry recorded, by size and, if asked, by sha256.
+    """
+    if size is None or entry.get('size') != size:
+        return False
+    if not check_hash:
+        return True
+    sha256 = hashlib.sha256()
+    try:
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                sha256.update(chunk)
+    except OSError:
+        return False
+    return entry.get('sha256') == sha256.hexdigest()
+
+def manifest_entry(subtitle, file_name, size_bytes, sha256, validators=None):
+    """
+    Describes a subtitle as it was saved: size and sha256 are of the local
+    file, and validators holds the ETag and Last-Modified the server sent.
+    """
+    validators = validators or {}
+    return {
+        'url': subtitle.get('url'),
+        'updated_at': subtitle.get('updated_at'),
+        'file_name': file_name,
+        'size': size_bytes,
+        'sha256': sha256,
+        'etag': validators.get('etag'),
+        'last_modified': validators.get('last_modified')
+    }